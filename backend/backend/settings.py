@@ -39,6 +39,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'corsheaders',
     'rest_framework',
+    'channels',
     'ikiyo_backend',
 ]
 
@@ -78,6 +79,15 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'backend.wsgi.application'
+ASGI_APPLICATION = 'backend.asgi.application'
+
+# Channel layer used to push chat messages over WebSockets.
+# In-memory only works within a single process; use channels_redis in production.
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    }
+}
 
 
 # Database
@@ -95,6 +105,17 @@ DATABASES = {
 }
 
 
+# Cache
+# Local memory is per process, which is fine for development and tests. Production
+# should point this at a shared cache (e.g. django.core.cache.backends.redis.RedisCache)
+# so cache invalidations (friend lists, ...) reach every worker.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -131,6 +152,31 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Composited avatar sprites (see ikiyo_backend/sprites.py). Point 'avatar_sprites' at a
+# CDN-backed storage in production; layers are fetched through AVATAR_LAYER_LOADER.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    'avatar_sprites': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {
+            'location': MEDIA_ROOT / 'avatar-sprites',
+            'base_url': f'/{MEDIA_URL}avatar-sprites/',
+        },
+    },
+}
+
+AVATAR_LAYER_LOADER = 'ikiyo_backend.sprites.fetch_layer'
+AVATAR_LAYER_HOSTS = ['res.cloudinary.com']  # The only hosts layer images are fetched from
+AVATAR_SPRITE_MAX_ENTRIES = 10000
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
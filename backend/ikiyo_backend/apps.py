@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class IkiyoBackendConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ikiyo_backend'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+        from . import signals  # noqa: F401  Connect cache invalidation receivers
+        from .search import create_search_indexes
+
+        post_migrate.connect(create_search_indexes, sender=self)
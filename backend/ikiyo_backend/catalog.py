@@ -0,0 +1,70 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from .models import Item
+from .serializers import ItemSerializer
+
+# The serialized shop catalog is cached per version. Any Item save/delete bumps
+# the version (see signals.py), which also changes the ETag clients revalidate with.
+CATALOG_CACHE_ALIAS = getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')
+CATALOG_PAYLOAD_TIMEOUT = 24 * 60 * 60
+CATALOG_PAGE_SIZE = 50
+MAX_CATALOG_PAGE_SIZE = 200
+
+_VERSION_KEY = 'catalog:version'
+
+
+def get_catalog_version():
+    cache = caches[CATALOG_CACHE_ALIAS]
+    version = cache.get(_VERSION_KEY)
+    if version is None:
+        # Unknown after a cache flush: start a fresh version so no stale ETag can match
+        cache.add(_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    caches[CATALOG_CACHE_ALIAS].set(_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def get_catalog(version=None):
+    """Return (version, serialized items), serializing at most once per version."""
+    cache = caches[CATALOG_CACHE_ALIAS]
+    version = version or get_catalog_version()
+    key = f"catalog:payload:{version}"
+
+    payload = cache.get(key)
+    if payload is None:
+        payload = list(ItemSerializer(Item.objects.all(), many=True).data)
+        cache.set(key, payload, CATALOG_PAYLOAD_TIMEOUT)
+    return version, payload
+
+
+def get_catalog_page(version, category=None, part=None, after=None, limit=CATALOG_PAGE_SIZE):
+    """
+    One page of the catalog filtered by category/part, keyset-paginated on item_id.
+    Returns (items, next_after); pages are cached per catalog version like the full list.
+    """
+    cache = caches[CATALOG_CACHE_ALIAS]
+    params = hashlib.md5(repr((category, part, after, limit)).encode()).hexdigest()
+    key = f"catalog:page:{version}:{params}"
+
+    page = cache.get(key)
+    if page is None:
+        items = Item.objects.order_by('item_id')
+        if category:
+            items = items.filter(category=Item.normalize_category(category))
+        if part:
+            items = items.filter(part=part)
+        if after is not None:
+            items = items.filter(item_id__gt=after)
+
+        rows = list(items[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        page = (list(ItemSerializer(rows, many=True).data), rows[-1].item_id if has_more else None)
+        cache.set(key, page, CATALOG_PAYLOAD_TIMEOUT)
+    return page
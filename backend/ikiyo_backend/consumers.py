@@ -0,0 +1,46 @@
+from asgiref.sync import async_to_sync
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from channels.layers import get_channel_layer
+
+
+def chat_group_name(user_id):
+    return f"chat_user_{user_id}"
+
+
+def broadcast_message(message_data):
+    """Push a serialized Message to the sender's and recipient's open sockets."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    event = {"type": "chat.message", "message": message_data}
+    for user_id in {message_data['sender'], message_data['recipient']}:
+        async_to_sync(channel_layer.group_send)(chat_group_name(user_id), event)
+
+
+def broadcast_read(reader_id, friend_id, up_to_id):
+    """Tell the friend's sockets that reader_id has read their messages up to up_to_id."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    event = {"type": "chat.read", "reader": reader_id, "up_to_id": up_to_id}
+    async_to_sync(channel_layer.group_send)(chat_group_name(friend_id), event)
+
+
+class ChatConsumer(AsyncJsonWebsocketConsumer):
+    """One socket per logged-in app instance: ws/chat/<userID>/"""
+
+    async def connect(self):
+        self.group_name = chat_group_name(self.scope['url_route']['kwargs']['user_id'])
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def chat_message(self, event):
+        await self.send_json({"type": "message", "data": event['message']})
+
+    async def chat_read(self, event):
+        await self.send_json({"type": "read", "reader": event['reader'], "up_to_id": event['up_to_id']})
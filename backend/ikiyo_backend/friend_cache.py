@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.cache import caches
+from .models import FriendList
+
+# Which CACHES alias holds the friend sets: local memory in development/tests,
+# a shared cache (e.g. Redis) in production so every worker sees invalidations.
+FRIEND_CACHE_ALIAS = getattr(settings, 'FRIEND_CACHE_ALIAS', 'default')
+FRIEND_CACHE_TIMEOUT = 60 * 60
+
+
+def _cache_key(user_id):
+    return f"friends:{user_id}"
+
+
+def get_friend_ids(user_id):
+    """Return the set of userIDs that user_id has an accepted friendship with."""
+    cache = caches[FRIEND_CACHE_ALIAS]
+    key = _cache_key(user_id)
+    friend_ids = cache.get(key)
+
+    if friend_ids is None:
+        # Rows are canonical (low, high), so the friend is whichever side user_id is not
+        as_low = FriendList.objects.filter(from_user_id=user_id, accepted=True).values_list('to_user_id', flat=True)
+        as_high = FriendList.objects.filter(to_user_id=user_id, accepted=True).values_list('from_user_id', flat=True)
+        friend_ids = frozenset(as_low.union(as_high, all=True))
+        cache.set(key, friend_ids, FRIEND_CACHE_TIMEOUT)
+
+    return friend_ids
+
+
+def are_friends(user_id, other_id):
+    return int(other_id) in get_friend_ids(int(user_id))
+
+
+def invalidate_friend_ids(*user_ids):
+    caches[FRIEND_CACHE_ALIAS].delete_many([_cache_key(user_id) for user_id in user_ids])
@@ -0,0 +1,137 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Max, Sum
+from django.utils import timezone
+from .models import BalanceSnapshot, CurrencyLedger, User
+
+# Tried in order when spending: gold if the user has enough, otherwise rubby
+CURRENCIES = ('gold', 'rubby')
+
+# Entries younger than this may still belong to an open transaction (ids are handed out
+# before commit), so reconciliation leaves them as deltas until the next run.
+RECONCILE_LAG = timedelta(seconds=60)
+
+
+class InsufficientBalance(Exception):
+    pass
+
+
+def debit(user_id, amount, reason, reference=None):
+    """
+    Take `amount` from the first currency that covers it, as a conditional UPDATE on
+    that one column, and append the ledger entry. Concurrent debits serialize on the
+    row lock and re-check the balance, so they can neither overdraw nor lose updates.
+    Call inside a transaction. Returns the currency charged.
+    """
+    for currency in CURRENCIES:
+        charged = User.objects.filter(userID=user_id, **{f'{currency}__gte': amount}).update(
+            **{currency: F(currency) - amount}
+        )
+        if charged:
+            CurrencyLedger.objects.create(user_id=user_id, currency=currency, amount=-amount, reason=reason, reference=reference)
+            return currency
+
+    if not User.objects.filter(userID=user_id).exists():
+        raise User.DoesNotExist
+    raise InsufficientBalance
+
+
+def credit(user_id, currency, amount, reason, reference=None):
+    """Add `amount` of `currency` with a single-column UPDATE plus its ledger entry."""
+    with transaction.atomic():
+        if not User.objects.filter(userID=user_id).update(**{currency: F(currency) + amount}):
+            raise User.DoesNotExist
+        CurrencyLedger.objects.create(user_id=user_id, currency=currency, amount=amount, reason=reason, reference=reference)
+
+
+def get_balances(user_id):
+    """{currency: balance} from the snapshots plus the ledger entries recorded after them."""
+    snapshots = {
+        snapshot['currency']: snapshot
+        for snapshot in BalanceSnapshot.objects.filter(user_id=user_id).values('currency', 'balance', 'ledger_id')
+    }
+    balances = {}
+    for currency in CURRENCIES:
+        snapshot = snapshots.get(currency, {'balance': 0, 'ledger_id': 0})
+        delta = CurrencyLedger.objects.filter(
+            user_id=user_id, currency=currency, id__gt=snapshot['ledger_id']
+        ).aggregate(total=Sum('amount'))['total'] or 0
+        balances[currency] = snapshot['balance'] + delta
+    return balances
+
+
+def reconcile(batch_size=1000):
+    """
+    Fold settled ledger entries into BalanceSnapshot, one batch of entries at a time in
+    id order. Never touches the User row. Returns the number of entries folded in.
+    """
+    cutoff = timezone.now() - RECONCILE_LAG
+    cursor = BalanceSnapshot.objects.aggregate(cursor=Max('ledger_id'))['cursor'] or 0
+    folded = 0
+
+    while True:
+        entries = list(
+            CurrencyLedger.objects.filter(id__gt=cursor, created_at__lt=cutoff)
+            .order_by('id')
+            .values_list('id', 'user_id', 'currency', 'amount')[:batch_size]
+        )
+        if not entries:
+            return folded
+
+        deltas = defaultdict(int)
+        last_ids = {}
+        for entry_id, user_id, currency, amount in entries:
+            deltas[user_id, currency] += amount
+            last_ids[user_id, currency] = entry_id
+
+        with transaction.atomic():
+            BalanceSnapshot.objects.bulk_create(
+                [BalanceSnapshot(user_id=user_id, currency=currency) for user_id, currency in deltas],
+                ignore_conflicts=True,
+            )
+            for (user_id, currency), delta in deltas.items():
+                BalanceSnapshot.objects.filter(user_id=user_id, currency=currency).update(
+                    balance=F('balance') + delta,
+                    ledger_id=last_ids[user_id, currency],
+                )
+
+        folded += len(entries)
+        cursor = entries[-1][0]
+
+
+def open_balances(batch_size=1000):
+    """
+    One-off: record each user's pre-ledger balance as an "opening" entry, so the
+    ledger sums to the current User.gold / User.rubby. Users already opened are skipped.
+    """
+    opened = CurrencyLedger.objects.filter(reason='opening').values('user_id')
+    users = User.objects.exclude(userID__in=opened).order_by('userID')
+    last_id = 0
+    created = 0
+
+    while True:
+        batch = list(users.filter(userID__gt=last_id).values('userID', *CURRENCIES)[:batch_size])
+        if not batch:
+            return created
+
+        recorded = defaultdict(int)
+        for row in CurrencyLedger.objects.filter(user_id__in=[user['userID'] for user in batch]).values(
+            'user_id', 'currency'
+        ).annotate(total=Sum('amount')).order_by():
+            recorded[row['user_id'], row['currency']] = row['total']
+
+        entries = [
+            CurrencyLedger(
+                user_id=user['userID'],
+                currency=currency,
+                amount=user[currency] - recorded[user['userID'], currency],
+                reason='opening',
+            )
+            for user in batch
+            for currency in CURRENCIES
+        ]
+        CurrencyLedger.objects.bulk_create(entries)
+        created += len(entries)
+        last_id = batch[-1]['userID']
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from ikiyo_backend.models import Message
+
+
+class Command(BaseCommand):
+    help = "Fill Message.conversation_key for messages sent before the column existed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        updated = 0
+
+        while True:
+            batch = list(
+                Message.objects.filter(id__gt=last_id, conversation_key__isnull=True)
+                .order_by('id')
+                .only('id', 'sender_id', 'recipient_id')[:batch_size]
+            )
+            if not batch:
+                break
+
+            for message in batch:
+                message.conversation_key = Message.conversation_key_for(message.sender_id, message.recipient_id)
+            Message.objects.bulk_update(batch, ['conversation_key'])
+
+            updated += len(batch)
+            last_id = batch[-1].id
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled conversation_key on {updated} message(s)."))
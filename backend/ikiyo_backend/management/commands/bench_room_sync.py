@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from ikiyo_backend.models import Inventory, Item, RoomItem, User
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a user owning many Room items inside a transaction, compare the query count and "
+        "time of the old per-stack sync loop with RoomItem.sync_for_owner(), then roll back. "
+        "The new sync's count still grows slowly with size: each bulk INSERT is split into "
+        "batches (small ones on SQLite, whose parameter limit is low)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500])
+        parser.add_argument('--copies', type=int, default=1, help="Copies owned of each item.")
+
+    def handle(self, *args, **options):
+        for size in options['sizes']:
+            with transaction.atomic():
+                owner = self.seed(size, options['copies'])
+                legacy_queries, legacy_time = self.measure(lambda: self.legacy_sync(owner))
+
+                RoomItem.objects.filter(item__owner=owner).delete()
+                queries, elapsed = self.measure(lambda: RoomItem.sync_for_owner(owner.userID))
+                created = RoomItem.objects.filter(item__owner=owner).count()
+
+                self.stdout.write(
+                    f"{size:>5} stacks ({created} RoomItems): loop {legacy_queries:>5} queries {legacy_time * 1000:8.1f} ms"
+                    f"   sync_for_owner {queries:>2} queries {elapsed * 1000:8.1f} ms"
+                )
+                transaction.set_rollback(True)
+
+    def seed(self, size, copies):
+        owner = User.objects.create(username="room_sync_bench", email="room_sync_bench@example.com", password='x')
+        items = Item.objects.bulk_create([
+            Item(item_name=f"Chair {n}", price=1, category="Room", part="chair", store_image=f"chair{n}.png")
+            for n in range(size)
+        ])
+        Inventory.objects.bulk_create([Inventory(owner=owner, item=item, quantity=copies) for item in items])
+        return owner
+
+    def legacy_sync(self, owner):
+        # The previous implementation: a count and an insert per stack, plus a lazy Item load
+        for inv in Inventory.objects.filter(owner=owner, item__category="Room"):
+            for _ in range(inv.quantity - RoomItem.objects.filter(item=inv).count()):
+                RoomItem.objects.create(
+                    item=inv, type=inv.item.part, x=0, y=0, width=1, height=1, state="idle",
+                    allowOverlap=False, placed=False, image=inv.item.store_image,
+                )
+
+    def measure(self, run):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+        return len(queries), elapsed
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from ikiyo_backend.models import User
+from ikiyo_backend.search import search_users
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a large User table inside a transaction, time the old icontains search "
+        "against search_users(), then roll everything back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        queries = ['1234', 'pl', 'player12', 'yer4567', 'plaeyr9']
+
+        with transaction.atomic():
+            self.seed(options['users'], options['batch_size'])
+
+            for query in queries:
+                legacy = self.timed(options['repeat'], lambda: list(
+                    User.objects.filter(Q(userID__icontains=query) | Q(username__icontains=query))
+                    .values('userID', 'username')
+                ))
+                indexed = self.timed(options['repeat'], lambda: search_users(query))
+                self.stdout.write(
+                    f"{query!r:>12}: icontains {legacy * 1000:8.2f} ms   search_users {indexed * 1000:8.2f} ms"
+                )
+
+            transaction.set_rollback(True)
+
+    def seed(self, count, batch_size):
+        start = time.perf_counter()
+        for offset in range(0, count, batch_size):
+            User.objects.bulk_create([
+                User(username=f"Player{n}_bench", email=f"player{n}_bench@example.com", password='x')
+                for n in range(offset, min(offset + batch_size, count))
+            ])
+        self.stdout.write(f"Seeded {count} users in {time.perf_counter() - start:.1f}s")
+
+    def timed(self, repeat, run):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            run()
+        return (time.perf_counter() - start) / repeat
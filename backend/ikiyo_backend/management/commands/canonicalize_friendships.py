@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+from ikiyo_backend.models import FriendList
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrite FriendList rows into canonical (lower userID, higher userID) order and drop "
+        "reversed duplicates. Run this before applying the friendlist_canonical_order constraint."
+    )
+
+    def handle(self, *args, **options):
+        reversed_rows = FriendList.objects.filter(from_user_id__gt=F('to_user_id'))
+        counterpart = FriendList.objects.filter(from_user_id=OuterRef('to_user_id'), to_user_id=OuterRef('from_user_id'))
+
+        with transaction.atomic():
+            # Pairs stored in both directions: keep the canonical row, accepted if either was
+            accepted_reversed = FriendList.objects.filter(
+                from_user_id__gt=F('to_user_id'),
+                accepted=True,
+                from_user_id=OuterRef('to_user_id'),
+                to_user_id=OuterRef('from_user_id'),
+            )
+            promoted = FriendList.objects.filter(
+                from_user_id__lt=F('to_user_id'), accepted=False
+            ).filter(Exists(accepted_reversed)).update(accepted=True)
+            removed, _ = reversed_rows.filter(Exists(counterpart)).delete()
+
+            # Everything else only needs its two columns swapped, in one UPDATE
+            swapped = reversed_rows.update(from_user_id=F('to_user_id'), to_user_id=F('from_user_id'))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Swapped {swapped} row(s), removed {removed} duplicate(s), accepted {promoted} pending pair(s)."
+        ))
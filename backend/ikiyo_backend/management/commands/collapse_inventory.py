@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Min, Sum
+from ikiyo_backend.models import Inventory, RoomItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Collapse duplicate Inventory rows into one (owner, item) stack with a quantity, "
+        "re-pointing their RoomItems. Run before applying the unique (owner, item) constraint."
+    )
+
+    def handle(self, *args, **options):
+        duplicates = (
+            Inventory.objects.values('owner_id', 'item_id')
+            .annotate(rows=Count('id'), keep=Min('id'), total=Sum('quantity'))
+            .filter(rows__gt=1)
+            .order_by()
+        )
+
+        stacks = removed = 0
+        for group in duplicates.iterator():
+            extra = Inventory.objects.filter(owner_id=group['owner_id'], item_id=group['item_id']).exclude(id=group['keep'])
+            with transaction.atomic():
+                RoomItem.objects.filter(item__in=extra).update(item_id=group['keep'])
+                Inventory.objects.filter(id=group['keep']).update(quantity=group['total'])
+                removed += extra.delete()[1].get(Inventory._meta.label, 0)
+            stacks += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Collapsed {removed} duplicate row(s) into {stacks} stack(s)."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from ikiyo_backend.sprites import compose_pending_sprites
+
+
+class Command(BaseCommand):
+    help = "Compose queued avatar sprites and evict the least recently used ones. Run periodically (e.g. every minute)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=100)
+
+    def handle(self, *args, **options):
+        composed, failed = compose_pending_sprites(limit=options['limit'])
+        self.stdout.write(self.style.SUCCESS(f"Composed {composed} sprite(s), {failed} failed."))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from ikiyo_backend.presence import flush_transitions
+
+
+class Command(BaseCommand):
+    help = "Write heartbeat presence transitions back to User.status. Run periodically (e.g. every minute)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        updated = flush_transitions(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Updated status on {updated} user(s)."))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from ikiyo_backend.catalog import bump_catalog_version
+from ikiyo_backend.models import Item
+
+
+class Command(BaseCommand):
+    help = "Rewrite Item.category into its normalized form (e.g. 'room' -> 'Room')."
+
+    def handle(self, *args, **options):
+        updated = 0
+        # One UPDATE per distinct spelling rather than per row
+        for category in Item.objects.values_list('category', flat=True).distinct().order_by():
+            normalized = Item.normalize_category(category)
+            if normalized != category:
+                updated += Item.objects.filter(category=category).update(category=normalized)
+
+        if updated:
+            bump_catalog_version()  # update() skips the post_save receiver
+        self.stdout.write(self.style.SUCCESS(f"Normalized category on {updated} item(s)."))
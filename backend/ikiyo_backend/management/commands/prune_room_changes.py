@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from ikiyo_backend.models import RoomChange, RoomState
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete room change log entries older than --days. Clients whose last seen version "
+        "is older than what remains get a full room on their next fetch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+
+        with transaction.atomic():
+            floors = (
+                RoomChange.objects.filter(created_at__lt=cutoff)
+                .values('owner_id').annotate(floor=Max('version')).values_list('owner_id', 'floor')
+            )
+            for owner_id, floor in floors:
+                RoomState.objects.filter(owner_id=owner_id, log_floor__lt=floor).update(log_floor=floor)
+                RoomChange.objects.filter(owner_id=owner_id, version__lte=floor).delete()
+
+        self.stdout.write(self.style.SUCCESS(f"Pruned the change log of {len(floors)} room(s)."))
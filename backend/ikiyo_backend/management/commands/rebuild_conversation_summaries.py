@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max
+from ikiyo_backend.models import ConversationSummary, Message
+
+
+class Command(BaseCommand):
+    help = "Rebuild every ConversationSummary (chat inbox row) from the Message table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        # Unread messages per (recipient, sender) pair
+        unread = {
+            (row['recipient_id'], row['sender_id']): row['unread']
+            for row in Message.objects.filter(is_read=False)
+            .values('recipient_id', 'sender_id')
+            .annotate(unread=Count('id'))
+            .order_by()
+        }
+        last_ids = list(
+            Message.objects.exclude(conversation_key__isnull=True)
+            .values('conversation_key')
+            .annotate(last_id=Max('id'))
+            .order_by()
+            .values_list('last_id', flat=True)
+        )
+
+        created = 0
+        with transaction.atomic():
+            ConversationSummary.objects.all().delete()
+
+            for start in range(0, len(last_ids), batch_size):
+                last_messages = Message.objects.filter(id__in=last_ids[start:start + batch_size]).only(
+                    'id', 'sender_id', 'recipient_id', 'timestamp'
+                )
+                summaries = []
+                for message in last_messages:
+                    for owner_id, friend_id in (
+                        (message.sender_id, message.recipient_id),
+                        (message.recipient_id, message.sender_id),
+                    ):
+                        summaries.append(ConversationSummary(
+                            owner_id=owner_id,
+                            friend_id=friend_id,
+                            last_message=message,
+                            last_timestamp=message.timestamp,
+                            unread_count=unread.get((owner_id, friend_id), 0),
+                        ))
+                ConversationSummary.objects.bulk_create(summaries)
+                created += len(summaries)
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {created} conversation summary row(s)."))
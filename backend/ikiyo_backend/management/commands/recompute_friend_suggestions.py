@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from ikiyo_backend.suggestions import SUGGESTIONS_PER_USER, recompute_all_suggestions, recompute_suggestions
+
+
+class Command(BaseCommand):
+    help = "Recompute the 'people you may know' table from the friendship graph. Run periodically."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--limit', type=int, default=SUGGESTIONS_PER_USER, help="Suggestions kept per user.")
+        parser.add_argument('--users', type=int, nargs='+', help="Only recompute these userIDs.")
+
+    def handle(self, *args, **options):
+        if options['users']:
+            created = recompute_suggestions(options['users'], limit=options['limit'])
+        else:
+            created = recompute_all_suggestions(batch_size=options['batch_size'], limit=options['limit'])
+        self.stdout.write(self.style.SUCCESS(f"Stored {created} friend suggestion(s)."))
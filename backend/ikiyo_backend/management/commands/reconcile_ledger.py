@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from ikiyo_backend.ledger import CURRENCIES, get_balances, open_balances, reconcile
+from ikiyo_backend.models import User
+
+
+class Command(BaseCommand):
+    help = "Fold settled currency ledger entries into balance snapshots. Run periodically."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--open', action='store_true', help="First run only: record current balances as opening entries.")
+        parser.add_argument('--verify', action='store_true', help="Compare snapshot + deltas with User.gold / User.rubby.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        if options['open']:
+            self.stdout.write(f"Recorded {open_balances(batch_size)} opening entr(ies).")
+
+        self.stdout.write(self.style.SUCCESS(f"Folded {reconcile(batch_size)} ledger entr(ies) into snapshots."))
+
+        if options['verify']:
+            mismatched = 0
+            for user in User.objects.order_by('userID').values('userID', *CURRENCIES).iterator(chunk_size=batch_size):
+                balances = get_balances(user['userID'])
+                for currency in CURRENCIES:
+                    if balances[currency] != user[currency]:
+                        mismatched += 1
+                        self.stdout.write(f"user {user['userID']} {currency}: ledger {balances[currency]}, column {user[currency]}")
+            if mismatched:
+                raise CommandError(f"{mismatched} balance(s) disagree with the ledger.")
+            self.stdout.write(self.style.SUCCESS("All balances match the ledger."))
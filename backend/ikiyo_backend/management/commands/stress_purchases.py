@@ -0,0 +1,61 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+from ikiyo_backend.models import Inventory, Item, User
+from ikiyo_backend.ledger import InsufficientBalance
+from ikiyo_backend.purchases import purchase_item
+
+
+class Command(BaseCommand):
+    help = (
+        "Fire parallel purchases at one throwaway user and check that the final balance and "
+        "inventory match the number of successful purchases. Needs a database with real row "
+        "locking (PostgreSQL); the user and item are deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=16)
+        parser.add_argument('--purchases', type=int, default=500)
+        parser.add_argument('--price', type=int, default=10)
+        parser.add_argument('--gold', type=int, default=2500, help="Starting gold; less than purchases * price exercises the overdraft check.")
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        user = User.objects.create(username=f"stress_{tag}", email=f"stress_{tag}@example.com", password='x', gold=options['gold'])
+        item = Item.objects.create(item_name=f"stress_{tag}", price=options['price'], category='Stress')
+
+        def buy(_):
+            try:
+                purchase_item(user.userID, item.item_id)
+                return True
+            except InsufficientBalance:
+                return False
+            finally:
+                connection.close()  # Each worker thread opened its own connection
+
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+                results = list(pool.map(buy, range(options['purchases'])))
+            elapsed = time.perf_counter() - start
+
+            succeeded = sum(results)
+            user.refresh_from_db(fields=['gold', 'rubby'])
+            owned = Inventory.objects.filter(owner=user, item=item).aggregate(total=Sum('quantity'))['total'] or 0
+            expected_gold = options['gold'] - succeeded * options['price']
+
+            self.stdout.write(
+                f"{options['purchases']} purchases on {options['workers']} workers in {elapsed:.2f}s "
+                f"({options['purchases'] / elapsed:.0f}/s): {succeeded} succeeded, "
+                f"gold {user.gold} (expected {expected_gold}), inventory quantity {owned}"
+            )
+            if user.gold != expected_gold or owned != succeeded or user.gold < 0:
+                raise CommandError("Balance and inventory disagree with the successful purchases.")
+            self.stdout.write(self.style.SUCCESS("Balances consistent."))
+        finally:
+            item.delete()
+            user.delete()
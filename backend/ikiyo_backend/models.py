@@ -1,5 +1,10 @@
-from django.db import models
+import hashlib
+
+from django.core.files.storage import storages
+from django.db import models, transaction
+from django.dispatch import Signal
 from django.conf import settings
+from django.db.models.functions import Lower
 
 class User(models.Model):
     userID = models.AutoField(primary_key=True)  # Auto-incrementing unique ID
@@ -19,6 +24,12 @@ class User(models.Model):
         related_name='partner'
     )
 
+    class Meta:
+        indexes = [
+            # Case-insensitive username lookups and ordering (prefix LIKE: see search.create_search_indexes)
+            models.Index(Lower('username'), name='user_username_lower_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         # Save the current buddy before saving
         old_buddy = None
@@ -43,6 +54,39 @@ class User(models.Model):
     def __str__(self):
         return self.username
 
+class CurrencyLedger(models.Model):
+    # Append-only: every gold/rubby change is one row, never updated or deleted
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ledger_entries')
+    currency = models.CharField(max_length=10)  # "gold" or "rubby"
+    amount = models.IntegerField()  # Signed: negative for spending
+    reason = models.CharField(max_length=50)  # e.g. "purchase", "checkout", "task_reward"
+    reference = models.CharField(max_length=100, blank=True, null=True)  # e.g. "item:12", "task:7"
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'currency', 'id'], name='ledger_user_currency_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.amount:+} {self.currency} ({self.reason})"
+
+
+class BalanceSnapshot(models.Model):
+    # Balance as of ledger entry `ledger_id`; later entries are the deltas still to add
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='balance_snapshots')
+    currency = models.CharField(max_length=10)
+    balance = models.IntegerField(default=0)
+    ledger_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'currency')
+
+    def __str__(self):
+        return f"{self.user_id} {self.currency}: {self.balance} @ {self.ledger_id}"
+
+
 class Avatar(models.Model):
     avatarID = models.AutoField(primary_key=True)  # Unique ID for the avatar
     user = models.OneToOneField('User', on_delete=models.CASCADE, related_name='avatar')
@@ -62,10 +106,74 @@ class Avatar(models.Model):
     lowerwear = models.URLField(null=True)
     shoes = models.URLField(null=True)
 
+    LAYER_FIELDS = (
+        'head', 'body', 'left_arm', 'right_arm', 'left_leg', 'right_leg',
+        'hat', 'eyes', 'face_accessories', 'facial_expression', 'upperwear', 'lowerwear', 'shoes',
+    )
+    # Slots filled from owned items (Item.part, lowercased); the base body layers are not equippable
+    EQUIP_SLOTS = ('hat', 'eyes', 'face_accessories', 'facial_expression', 'upperwear', 'lowerwear', 'shoes')
+
+    @staticmethod
+    def slot_for_part(part):
+        # Catalog parts are display names: "Face Accessories" -> "face_accessories"
+        return (part or "").strip().lower().replace(' ', '_')
+
     def __str__(self):
         return f"{self.user.username}'s Avatar"
+
+    @classmethod
+    def content_hash(cls, layers):
+        # Changes whenever any layer URL changes, so clients can skip re-rendering an unchanged avatar
+        payload = "\n".join(layers.get(field) or "" for field in cls.LAYER_FIELDS)
+        return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+    @property
+    def sprite_url(self):
+        # Content-addressed location; the file exists once compose_avatar_sprites has built it
+        return AvatarSprite.url_for(Avatar.content_hash({field: getattr(self, field) for field in self.LAYER_FIELDS}))
+
+    @classmethod
+    def layer_rows(cls, user_ids):
+        """Avatar payloads for `user_ids` from a single user_id__in query, keyed by user id."""
+        rows = cls.objects.filter(user_id__in=user_ids).values('avatarID', 'user_id', *cls.LAYER_FIELDS)
+        return {
+            row['user_id']: {
+                "avatarID": row['avatarID'],
+                "userID": row['user_id'],
+                **{field: row[field] for field in cls.LAYER_FIELDS},
+                "hash": cls.content_hash(row),
+            }
+            for row in rows
+        }
     
 
+class AvatarSprite(models.Model):
+    # One composited avatar image, addressed by Avatar.content_hash; last_used_at drives LRU eviction.
+    # Rows start pending (ready=False) and are composed off the request path by compose_avatar_sprites.
+    content_hash = models.CharField(max_length=16, primary_key=True)
+    layers = models.JSONField(default=dict)  # The layer URLs to compose
+    ready = models.BooleanField(default=False)
+    failed_at = models.DateTimeField(null=True, blank=True)  # Last failed compose; retried after a delay
+    size = models.PositiveIntegerField(default=0)  # Bytes
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    @staticmethod
+    def storage():
+        return storages['avatar_sprites']
+
+    @staticmethod
+    def file_name(content_hash):
+        return f"{content_hash}.png"
+
+    @classmethod
+    def url_for(cls, content_hash):
+        return cls.storage().url(cls.file_name(content_hash))
+
+    def __str__(self):
+        return self.content_hash
+
+
 class PartnerRequest(models.Model):
     from_user = models.ForeignKey(User, related_name='sent_partner_requests', on_delete=models.CASCADE)
     to_user = models.ForeignKey(User, related_name='received_partner_requests', on_delete=models.CASCADE)
@@ -97,18 +205,71 @@ class Item(models.Model):
     store_image = models.CharField(max_length=255, blank=True, null=True) 
     avatar_image = models.CharField(max_length=255, blank=True, null=True)  
     price = models.DecimalField(max_digits=10, decimal_places=2)
-    category = models.CharField(max_length=100)
+    category = models.CharField(max_length=100)  # Stored normalized, e.g. "Room", "Avatar"
     part = models.CharField(max_length=100, blank=True, null=True)  # Can be null
 
+    class Meta:
+        indexes = [
+            # Shop tabs: filter by category (and part), paginate by item_id
+            models.Index(fields=['category', 'part', 'item_id'], name='item_category_part_idx'),
+        ]
+
+    @staticmethod
+    def normalize_category(category):
+        return category.strip().capitalize()
+
+    def save(self, *args, **kwargs):
+        self.category = Item.normalize_category(self.category)
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return self.item_name
 
 class Inventory(models.Model):
+    # One row per (owner, item) stack; buying another copy bumps quantity
     owner = models.ForeignKey(User, on_delete=models.CASCADE)  # If user is deleted, remove items
     item = models.ForeignKey(Item, on_delete=models.CASCADE)  # If item is deleted, remove from inventory
+    quantity = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        unique_together = ('owner', 'item')
+
+    @classmethod
+    def add_items(cls, owner_id, counts):
+        """
+        Add {item_id: copies} to the owner's stacks: insert any missing stacks empty,
+        then increment them all in one UPDATE. Safe against concurrent purchases.
+        """
+        cls.objects.bulk_create(
+            [cls(owner_id=owner_id, item_id=item_id, quantity=0) for item_id in counts],
+            ignore_conflicts=True,
+        )
+        cls.objects.filter(owner_id=owner_id, item_id__in=list(counts)).update(
+            quantity=models.F('quantity') + models.Case(
+                *[models.When(item_id=item_id, then=models.Value(copies)) for item_id, copies in counts.items()],
+                output_field=models.PositiveIntegerField(),
+            )
+        )
+
+    @classmethod
+    def item_rows(cls, owner_id, category=None):
+        """The owner's items (Item columns plus quantity) as one joined query, optionally one category."""
+        stacks = cls.objects.filter(owner_id=owner_id)
+        if category:
+            stacks = stacks.filter(item__category=Item.normalize_category(category))
+        return stacks.order_by('item_id').values(
+            'item_id',
+            'quantity',
+            item_name=models.F('item__item_name'),
+            store_image=models.F('item__store_image'),
+            avatar_image=models.F('item__avatar_image'),
+            price=models.F('item__price'),
+            category=models.F('item__category'),
+            part=models.F('item__part'),
+        )
 
     def __str__(self):
-        return f"{self.owner.username} owns {self.item.item_name}"
+        return f"{self.owner.username} owns {self.quantity} × {self.item.item_name}"
 
 class RoomItem(models.Model):
 
@@ -126,6 +287,108 @@ class RoomItem(models.Model):
     def __str__(self):
         return f"{self.item.item.item_name}"
 
+    @classmethod
+    def sync_for_owner(cls, owner_id):
+        """
+        Give every owned copy of a Room item exactly one RoomItem. One grouped anti-join finds
+        the stacks whose RoomItem count differs from their quantity; one bulk_create fills
+        the gaps, and surplus rows (unplaced and newest first) go in one DELETE. Rows of
+        stacks already in sync are not touched. Returns the number of RoomItems created.
+        """
+        with transaction.atomic():
+            # Serialize syncs per owner so two concurrent calls cannot both fill the same gap
+            User.objects.select_for_update().filter(userID=owner_id).exists()
+            unsynced = (
+                Inventory.objects.filter(owner_id=owner_id, item__category="Room")
+                .annotate(synced=models.Count('roomitem'))
+                .exclude(synced=models.F('quantity'))
+                .values_list('id', 'quantity', 'synced', 'item__part', 'item__store_image')
+            )
+            missing, surplus = [], {}
+            for stack_id, quantity, synced, part, image in unsynced:
+                if synced > quantity:
+                    surplus[stack_id] = synced - quantity
+                    continue
+                missing.extend(
+                    cls(item_id=stack_id, type=part, x=0, y=0, width=1, height=1, state="idle",
+                        allowOverlap=False, placed=False, image=image)
+                    for _ in range(quantity - synced)
+                )
+
+            if surplus:
+                extra = []
+                for room_item_id, stack_id in (
+                    cls.objects.filter(item_id__in=list(surplus)).order_by('placed', '-id').values_list('id', 'item_id')
+                ):
+                    if surplus[stack_id]:
+                        extra.append(room_item_id)
+                        surplus[stack_id] -= 1
+                cls.objects.filter(id__in=extra).delete()  # Logged as removals by signals.py
+
+            cls.objects.bulk_create(missing)
+            RoomChange.record(owner_id, changed=[room_item.id for room_item in missing])
+        return len(missing)
+
+    @classmethod
+    def rows_for_owner(cls, owner_id, ids=None, placed_only=False):
+        """The owner's Room items in RoomItemSerializer's shape from one joined query, optionally just `ids`."""
+        room_items = cls.objects.filter(item__owner_id=owner_id, item__item__category="Room")
+        if ids is not None:
+            room_items = room_items.filter(id__in=ids)
+        if placed_only:
+            room_items = room_items.filter(placed=True)
+        return list(room_items.order_by('id').values(
+            'id', 'type', 'x', 'y', 'width', 'height', 'state', 'allowOverlap', 'placed', 'image',
+            item_name=models.F('item__item__item_name'),
+        ))
+
+
+# Sent after commit with owner_id and version whenever a room's version moves on
+room_version_changed = Signal()
+
+
+class RoomState(models.Model):
+    # Version of a user's room, bumped once per write to its RoomItems (see RoomChange)
+    owner = models.OneToOneField(User, primary_key=True, related_name='room_state', on_delete=models.CASCADE)
+    version = models.PositiveBigIntegerField(default=0)
+    log_floor = models.PositiveBigIntegerField(default=0)  # RoomChange rows up to this version were pruned
+
+    def __str__(self):
+        return f"{self.owner_id}'s room v{self.version}"
+
+
+class RoomChange(models.Model):
+    # Which RoomItems a room version touched; clients catch up by replaying versions after theirs
+    owner = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    version = models.PositiveBigIntegerField()
+    room_item_id = models.IntegerField()  # Not a FK: removed items stay in the log
+    removed = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'version'], name='room_change_version_idx'),
+        ]
+
+    @classmethod
+    def record(cls, owner_id, changed=(), removed=()):
+        """
+        Bump the owner's room version and log the RoomItems written at it. Call inside the
+        writing transaction: the version UPDATE locks the room, so versions commit in order.
+        Returns the new version (None when nothing changed).
+        """
+        if not changed and not removed:
+            return None
+        RoomState.objects.bulk_create([RoomState(owner_id=owner_id)], ignore_conflicts=True)
+        RoomState.objects.filter(owner_id=owner_id).update(version=models.F('version') + 1)
+        version = RoomState.objects.values_list('version', flat=True).get(owner_id=owner_id)
+        cls.objects.bulk_create(
+            [cls(owner_id=owner_id, version=version, room_item_id=room_item_id) for room_item_id in changed]
+            + [cls(owner_id=owner_id, version=version, room_item_id=room_item_id, removed=True) for room_item_id in removed]
+        )
+        transaction.on_commit(lambda: room_version_changed.send(sender=RoomState, owner_id=owner_id, version=version))
+        return version
+
 
 class Task(models.Model):
     assigned_by = models.ForeignKey(
@@ -170,13 +433,59 @@ class FriendList(models.Model):
     accepted = models.BooleanField(default=False)
 
     class Meta:
+        # Friendships are undirected: one row per pair, stored as (lower userID, higher userID)
         unique_together = ('from_user', 'to_user')
+        constraints = [
+            models.CheckConstraint(condition=models.Q(from_user__lt=models.F('to_user')), name='friendlist_canonical_order'),
+        ]
+
+    @staticmethod
+    def canonical_pair(user_a_id, user_b_id):
+        low, high = sorted([int(user_a_id), int(user_b_id)])
+        return low, high
+
+    @classmethod
+    def friend_rows(cls, user_id):
+        """userID, username and status of every accepted friend, as one UNION ALL query."""
+        as_low = cls.objects.filter(from_user_id=user_id, accepted=True).values(
+            userID=models.F('to_user_id'),
+            username=models.F('to_user__username'),
+            status=models.F('to_user__status'),
+        )
+        as_high = cls.objects.filter(to_user_id=user_id, accepted=True).values(
+            userID=models.F('from_user_id'),
+            username=models.F('from_user__username'),
+            status=models.F('from_user__status'),
+        )
+        return as_low.union(as_high, all=True)
+
+    def save(self, *args, **kwargs):
+        if self.from_user_id > self.to_user_id:
+            self.from_user_id, self.to_user_id = self.to_user_id, self.from_user_id
+        super().save(*args, **kwargs)
 
     def __str__(self):
         status = "Accepted" if self.accepted else "Pending"
         return f"{self.from_user} → {self.to_user} ({status})"
 
 
+class FriendSuggestion(models.Model):
+    # "People you may know", precomputed by the recompute_friend_suggestions command
+    user = models.ForeignKey('User', on_delete=models.CASCADE, related_name='friend_suggestions')
+    candidate = models.ForeignKey('User', on_delete=models.CASCADE, related_name='+')
+    mutual_count = models.IntegerField()
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'candidate')
+        indexes = [
+            models.Index(fields=['user', '-mutual_count'], name='suggestion_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.candidate} for {self.user} ({self.mutual_count} mutual)"
+
+
 class FriendRequest(models.Model):
     from_user = models.ForeignKey(
         'User',
@@ -202,13 +511,72 @@ class Message(models.Model):
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
+    # "<low userID>:<high userID>", the same for both directions of a chat
+    conversation_key = models.CharField(max_length=41, blank=True, null=True)
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['conversation_key', 'id'], name='message_conversation_idx'),
+        ]
+
+    @staticmethod
+    def conversation_key_for(user_a_id, user_b_id):
+        low, high = sorted([int(user_a_id), int(user_b_id)])
+        return f"{low}:{high}"
+
+    def save(self, *args, **kwargs):
+        if not self.conversation_key:
+            self.conversation_key = Message.conversation_key_for(self.sender_id, self.recipient_id)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f'Message from {self.sender} to {self.recipient}'
 
+
+class ConversationSummary(models.Model):
+    # One row per participant, so a user's inbox is a single (owner, last_timestamp) index scan
+    owner = models.ForeignKey(User, related_name='conversations', on_delete=models.CASCADE)
+    friend = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    last_message = models.ForeignKey(Message, related_name='+', on_delete=models.SET_NULL, null=True, blank=True)
+    last_timestamp = models.DateTimeField(null=True, blank=True)
+    unread_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('owner', 'friend')
+        indexes = [
+            models.Index(fields=['owner', '-last_timestamp'], name='conversation_inbox_idx'),
+        ]
+
+    @classmethod
+    def record_message(cls, message):
+        """Move both participants' summaries to this message; one more unread for the recipient."""
+        for owner_id, friend_id, unread in (
+            (message.sender_id, message.recipient_id, 0),
+            (message.recipient_id, message.sender_id, 1),
+        ):
+            updated = cls.objects.filter(owner_id=owner_id, friend_id=friend_id).update(
+                last_message=message,
+                last_timestamp=message.timestamp,
+                unread_count=models.F('unread_count') + unread,
+            )
+            if not updated:
+                summary, created = cls.objects.get_or_create(
+                    owner_id=owner_id,
+                    friend_id=friend_id,
+                    defaults={'last_message': message, 'last_timestamp': message.timestamp, 'unread_count': unread},
+                )
+                if not created:
+                    # Lost a race with a concurrent first message; fall back to the update
+                    cls.objects.filter(pk=summary.pk).update(
+                        last_message=message,
+                        last_timestamp=message.timestamp,
+                        unread_count=models.F('unread_count') + unread,
+                    )
+
+    def __str__(self):
+        return f'{self.owner} ↔ {self.friend} ({self.unread_count} unread)'
+
 class GameInfo(models.Model):
     info_id = models.AutoField(primary_key=True)
     info_title = models.CharField(max_length=255)
@@ -0,0 +1,79 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from .models import User
+
+# Heartbeats live only in the cache. Clients send one every ~30s while foregrounded,
+# so a user whose key has expired is offline.
+PRESENCE_CACHE_ALIAS = getattr(settings, 'PRESENCE_CACHE_ALIAS', 'default')
+PRESENCE_TTL = 90
+TRANSITION_LOG_TTL = 24 * 60 * 60
+
+OFFLINE = 'offline'
+PRESENCE_STATES = ('online', 'away', OFFLINE)
+
+_SEQ_KEY = 'presence:seq'
+_CURSOR_KEY = 'presence:flushed'
+
+
+def _key(user_id):
+    return f"presence:{user_id}"
+
+
+def _log_key(seq):
+    return f"presence:log:{seq}"
+
+
+def heartbeat(user_id, state='online'):
+    """Record that user_id is in `state` right now; costs no database write."""
+    cache = caches[PRESENCE_CACHE_ALIAS]
+    key = _key(user_id)
+    previous = cache.get(key, OFFLINE)
+
+    if state == OFFLINE:
+        cache.delete(key)
+    else:
+        cache.set(key, state, PRESENCE_TTL)
+
+    if previous != state:
+        # Append-only log of who changed, read by flush_transitions()
+        cache.add(_SEQ_KEY, 0, None)
+        cache.set(_log_key(cache.incr(_SEQ_KEY)), int(user_id), TRANSITION_LOG_TTL)
+
+
+def get_presence(user_ids):
+    """Return {userID: state} for every id, in one cache round trip."""
+    user_ids = [int(user_id) for user_id in user_ids]
+    found = caches[PRESENCE_CACHE_ALIAS].get_many([_key(user_id) for user_id in user_ids])
+    return {user_id: found.get(_key(user_id), OFFLINE) for user_id in user_ids}
+
+
+def flush_transitions(batch_size=1000):
+    """
+    Write presence changes back to User.status, touching only rows whose state changed.
+    Candidates are users logged since the last flush plus users the database still
+    shows as present (their heartbeat may have expired without a transition entry).
+    """
+    cache = caches[PRESENCE_CACHE_ALIAS]
+    head = cache.get(_SEQ_KEY, 0)
+    cursor = cache.get(_CURSOR_KEY, 0)
+
+    candidates = set()
+    for start in range(cursor + 1, head + 1, batch_size):
+        candidates.update(cache.get_many([_log_key(seq) for seq in range(start, min(start + batch_size, head + 1))]).values())
+    candidates.update(User.objects.exclude(status=OFFLINE).values_list('userID', flat=True).iterator(chunk_size=batch_size))
+
+    candidates = list(candidates)
+    updated = 0
+    for start in range(0, len(candidates), batch_size):
+        by_state = defaultdict(list)
+        for user_id, state in get_presence(candidates[start:start + batch_size]).items():
+            by_state[state].append(user_id)
+
+        # One single-column UPDATE per state; rows already in that state are skipped
+        for state, user_ids in by_state.items():
+            updated += User.objects.filter(userID__in=user_ids).exclude(status=state).update(status=state)
+
+    cache.set(_CURSOR_KEY, head, None)
+    return updated
@@ -0,0 +1,40 @@
+import math
+from collections import Counter
+
+from django.db import transaction
+from .ledger import debit
+from .models import Inventory, Item
+
+
+def _charge(price):
+    # Balances are whole coins; a fractional catalog price rounds up, as the old
+    # float-then-int save effectively did
+    return math.ceil(price)
+
+
+def purchase_item(user_id, item_id):
+    """Charge the item's catalog price and add it to the inventory in one short transaction."""
+    price = Item.objects.filter(item_id=item_id).values_list('price', flat=True).first()
+    if price is None:
+        raise Item.DoesNotExist
+
+    with transaction.atomic():
+        currency = debit(user_id, _charge(price), reason='purchase', reference=f"item:{item_id}")
+        Inventory.add_items(user_id, {item_id: 1})
+    return currency, price
+
+
+def checkout(user_id, item_ids):
+    """
+    Buy every item in `item_ids` (repeats allowed) for the sum of their catalog prices:
+    one price query, one debit and one stack upsert, all or nothing.
+    """
+    prices = dict(Item.objects.filter(item_id__in=set(item_ids)).values_list('item_id', 'price'))
+    if len(prices) != len(set(item_ids)):
+        raise Item.DoesNotExist
+
+    total = sum(prices[item_id] for item_id in item_ids)
+    with transaction.atomic():
+        currency = debit(user_id, _charge(total), reason='checkout', reference=f"items:{len(item_ids)}")
+        Inventory.add_items(user_id, Counter(item_ids))
+    return currency, total
@@ -0,0 +1,321 @@
+from collections import defaultdict
+from itertools import combinations
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, transaction
+from .models import Inventory, RoomChange, RoomItem, RoomState, User
+
+# Visit snapshots are cached per room version. The current version is cached too and
+# moved on after every room write (see signals.py), so a repeat visit reads no database.
+ROOM_CACHE_ALIAS = getattr(settings, 'ROOM_CACHE_ALIAS', 'default')
+ROOM_VISIT_TIMEOUT = 24 * 60 * 60
+
+# Side of a spatial-hash bucket, in room grid units. Items only get compared with
+# items sharing a bucket, so a layout check stays close to linear in the item count.
+COLLISION_BUCKET_SIZE = 4
+MAX_LAYOUT_SIZE = 500
+
+# The columns a layout save may write
+LAYOUT_FIELDS = ('x', 'y', 'width', 'height', 'placed')
+
+# Room size in grid cells, matching the client's 20 x 10 cell room
+ROOM_GRID_WIDTH = 20
+ROOM_GRID_HEIGHT = 10
+
+
+class LayoutConflict(Exception):
+    def __init__(self, conflicts):
+        super().__init__(f"{len(conflicts)} overlapping placement(s).")
+        self.conflicts = conflicts
+
+
+def overlaps(a, b):
+    return a['x'] < b['x'] + b['width'] and b['x'] < a['x'] + a['width'] \
+        and a['y'] < b['y'] + b['height'] and b['y'] < a['y'] + a['height']
+
+
+def find_collisions(rects, bucket_size=COLLISION_BUCKET_SIZE, width=ROOM_GRID_WIDTH, height=ROOM_GRID_HEIGHT):
+    """
+    Return sorted [id, id] pairs of overlapping rects (dicts with id, x, y, width, height,
+    allowOverlap). A pair where either item allows overlap is not a conflict.
+    """
+    # Bucket indexes are clamped to the room, so an oversized rect costs a bounded number
+    # of buckets; anything beyond the edge shares the edge buckets and is still compared
+    last_bx, last_by = (width - 1) // bucket_size, (height - 1) // bucket_size
+
+    def span(start, size, last):
+        return range(min(max(start // bucket_size, 0), last), min(max((start + size - 1) // bucket_size, 0), last) + 1)
+
+    buckets = defaultdict(list)
+    for rect in rects:
+        if rect['allowOverlap']:
+            continue
+        for bx in span(rect['x'], rect['width'], last_bx):
+            for by in span(rect['y'], rect['height'], last_by):
+                buckets[bx, by].append(rect)
+
+    conflicts = set()
+    for bucket in buckets.values():
+        for a, b in combinations(bucket, 2):
+            if overlaps(a, b):
+                conflicts.add(tuple(sorted((a['id'], b['id']))))
+    return [list(pair) for pair in sorted(conflicts)]
+
+
+class OccupancyGrid:
+    """
+    Room cells as one bitmask per row (bit x set = cell occupied). Finding a free w x h
+    spot costs O(height * (w + h)) integer operations, however many items are in the room.
+    """
+
+    def __init__(self, width=ROOM_GRID_WIDTH, height=ROOM_GRID_HEIGHT):
+        self.width = width
+        self.height = height
+        self.rows = [0] * height
+
+    def occupy(self, x, y, width, height):
+        # Parts outside the room are clipped away
+        x0, x1 = max(x, 0), min(x + width, self.width)
+        mask = ((1 << (x1 - x0)) - 1) << x0 if x1 > x0 else 0
+        for row in range(max(y, 0), min(y + height, self.height)):
+            self.rows[row] |= mask
+
+    def find_free(self, width, height):
+        """First fit, top to bottom then left to right: the (x, y) of a free spot, or None."""
+        if width > self.width or height > self.height:
+            return None
+        full = (1 << self.width) - 1
+        starts_in_room = (1 << (self.width - width + 1)) - 1
+
+        # fits[row]: bit x set when cells x .. x+width-1 of that row are all free
+        fits = []
+        for occupied in self.rows:
+            free = ~occupied & full
+            run = free
+            for shift in range(1, width):
+                run &= free >> shift
+            fits.append(run & starts_in_room)
+
+        for y in range(self.height - height + 1):
+            candidates = fits[y]
+            for row in range(y + 1, y + height):
+                candidates &= fits[row]
+                if not candidates:
+                    break
+            if candidates:
+                return (candidates & -candidates).bit_length() - 1, y
+        return None
+
+
+def _clean_placement(placement):
+    if not isinstance(placement, dict):
+        raise ValueError("Each placement must be an object.")
+    try:
+        cleaned = {'id': int(placement['room_item_id'])}
+        for field in ('x', 'y', 'width', 'height'):
+            if placement.get(field) is not None:
+                cleaned[field] = int(placement[field])
+    except KeyError:
+        raise ValueError("Each placement needs a room_item_id.")
+    except (TypeError, ValueError):
+        raise ValueError("room_item_id, x, y, width and height must be integers.")
+    if cleaned.get('x', 0) < 0 or cleaned.get('y', 0) < 0:
+        raise ValueError("x and y must not be negative.")
+    if cleaned.get('width', 1) < 1 or cleaned.get('height', 1) < 1:
+        raise ValueError("width and height must be at least 1.")
+    cleaned['placed'] = bool(placement.get('placed', True))
+    return cleaned
+
+
+def save_layout(owner_id, placements):
+    """
+    Apply a batch of placements ({room_item_id, x, y, width, height, placed}) to the owner's
+    room and check the resulting layout, including items the batch does not move.
+    All or nothing: raises LayoutConflict with the overlapping pairs, or ValueError for bad
+    input (RoomItem.DoesNotExist for ids the owner does not have). Returns the RoomItems saved.
+    """
+    if not isinstance(placements, list) or not placements:
+        raise ValueError("placements must be a non-empty list.")
+    if len(placements) > MAX_LAYOUT_SIZE:
+        raise ValueError(f"At most {MAX_LAYOUT_SIZE} placements per request.")
+    changes = {}
+    for placement in placements:
+        cleaned = _clean_placement(placement)
+        changes[cleaned['id']] = cleaned  # The last placement for an item wins
+
+    with transaction.atomic():
+        # Lock the whole room: concurrent saves validate against each other's result
+        room = {
+            room_item.id: room_item
+            for room_item in RoomItem.objects.select_for_update().filter(
+                item__owner_id=owner_id, item__item__category="Room"
+            ).only('id', *LAYOUT_FIELDS, 'allowOverlap')
+        }
+        if not set(changes) <= set(room):
+            raise RoomItem.DoesNotExist
+
+        for room_item_id, change in changes.items():
+            room_item = room[room_item_id]
+            for field, value in change.items():
+                setattr(room_item, field, value)
+            if room_item.placed and (
+                room_item.x + room_item.width > ROOM_GRID_WIDTH or room_item.y + room_item.height > ROOM_GRID_HEIGHT
+            ):
+                raise ValueError(f"Room item {room_item_id} does not fit in the {ROOM_GRID_WIDTH} x {ROOM_GRID_HEIGHT} room.")
+
+        conflicts = find_collisions([
+            {field: getattr(room_item, field) for field in ('id', 'x', 'y', 'width', 'height', 'allowOverlap')}
+            for room_item in room.values() if room_item.placed
+        ])
+        if conflicts:
+            raise LayoutConflict(conflicts)
+
+        saved = [room[room_item_id] for room_item_id in changes]
+        RoomItem.objects.bulk_update(saved, LAYOUT_FIELDS)
+        RoomChange.record(owner_id, changed=list(changes))
+    return saved
+
+
+def auto_place(owner_id, room_item_ids=None):
+    """
+    Put the owner's unplaced Room items (or just `room_item_ids`) into free space, largest
+    first, around everything already placed. Returns ([{id, x, y, width, height}] for the
+    items placed, ids that did not fit).
+    """
+    with transaction.atomic():
+        room = list(
+            RoomItem.objects.select_for_update().filter(item__owner_id=owner_id, item__item__category="Room")
+            .only('id', *LAYOUT_FIELDS, 'allowOverlap').order_by('id')
+        )
+
+        grid = OccupancyGrid()
+        for room_item in room:
+            if room_item.placed and not room_item.allowOverlap:
+                grid.occupy(room_item.x, room_item.y, room_item.width, room_item.height)
+
+        wanted = None if room_item_ids is None else set(room_item_ids)
+        pending = [
+            room_item for room_item in room
+            if not room_item.placed and (wanted is None or room_item.id in wanted)
+        ]
+        pending.sort(key=lambda room_item: -room_item.width * room_item.height)
+
+        placed, unfit = [], []
+        for room_item in pending:
+            spot = grid.find_free(room_item.width, room_item.height)
+            if spot is None:
+                unfit.append(room_item.id)
+                continue
+            room_item.x, room_item.y = spot
+            room_item.placed = True
+            grid.occupy(room_item.x, room_item.y, room_item.width, room_item.height)
+            placed.append(room_item)
+
+        RoomItem.objects.bulk_update(placed, LAYOUT_FIELDS)
+        RoomChange.record(owner_id, changed=[room_item.id for room_item in placed])
+    return [
+        {field: getattr(room_item, field) for field in ('id', 'x', 'y', 'width', 'height')} for room_item in placed
+    ], unfit
+
+
+class RemovalBatch:
+    """RoomItems deleted in one transaction, logged after commit as one version per owner."""
+
+    def __init__(self):
+        self.owners = {}  # Inventory stack id -> owner id, one lookup per stack
+        self.removed = defaultdict(list)
+        self.recorded = False
+
+    def add(self, stack_id, room_item_id):
+        if stack_id not in self.owners:
+            # Still readable here: a cascade deletes RoomItems before their stack
+            self.owners[stack_id] = Inventory.objects.filter(id=stack_id).values_list('owner_id', flat=True).first()
+        if self.owners[stack_id] is not None:
+            self.removed[self.owners[stack_id]].append(room_item_id)
+
+    def record(self):
+        self.recorded = True
+        if not self.removed:
+            return
+        with transaction.atomic():
+            # Owners deleted along with their items have no room left to version, and rows
+            # still present were deleted inside a savepoint that rolled back
+            live = set(User.objects.filter(userID__in=list(self.removed)).values_list('userID', flat=True))
+            kept = set(RoomItem.objects.filter(
+                id__in=[room_item_id for ids in self.removed.values() for room_item_id in ids]
+            ).values_list('id', flat=True))
+            for owner_id, room_item_ids in self.removed.items():
+                room_item_ids = [room_item_id for room_item_id in room_item_ids if room_item_id not in kept]
+                if owner_id in live and room_item_ids:
+                    RoomChange.record(owner_id, removed=room_item_ids)
+
+
+def queue_room_removal(stack_id, room_item_id, using='default'):
+    """
+    Add a deleted RoomItem to the current transaction's RemovalBatch. The batch lives on
+    the connection only while its record() is still waiting in the on-commit queue; a
+    commit runs it and a rollback drops it, so the next transaction starts a fresh one.
+    """
+    connection = connections[using]
+    batch = getattr(connection, '_room_removals', None)
+    if batch is None or batch.recorded or not any(
+        callback == batch.record for _, callback, _ in connection.run_on_commit
+    ):
+        batch = connection._room_removals = RemovalBatch()
+        transaction.on_commit(batch.record, using=using)
+    batch.add(stack_id, room_item_id)
+
+
+def room_snapshot(owner_id, since_version=None):
+    """
+    The owner's room for a client that last saw `since_version`: just the items changed or
+    removed since then, or every item ("full") when there is no usable version to diff from.
+    """
+    state = RoomState.objects.filter(owner_id=owner_id).values('version', 'log_floor').first()
+    version, log_floor = (state['version'], state['log_floor']) if state else (0, 0)
+
+    if since_version is None or not log_floor <= since_version <= version:
+        return {"version": version, "full": True, "room_items": RoomItem.rows_for_owner(owner_id)}
+
+    # Latest entry per item wins
+    changes = dict(
+        RoomChange.objects.filter(owner_id=owner_id, version__gt=since_version, version__lte=version)
+        .order_by('version', 'id').values_list('room_item_id', 'removed')
+    )
+    changed_ids = [room_item_id for room_item_id, removed in changes.items() if not removed]
+    changed = RoomItem.rows_for_owner(owner_id, ids=changed_ids) if changed_ids else []
+    found = {row['id'] for row in changed}
+    removed = sorted(room_item_id for room_item_id in changes if room_item_id not in found)
+    return {"version": version, "full": False, "changed": changed, "removed": removed}
+
+
+def _visit_version_key(owner_id):
+    return f"room:visit-version:{owner_id}"
+
+
+def publish_room_version(owner_id, version):
+    caches[ROOM_CACHE_ALIAS].set(_visit_version_key(owner_id), version, ROOM_VISIT_TIMEOUT)
+
+
+def visit_snapshot(owner_id):
+    """The owner's placed items as visitors see them, built at most once per room version."""
+    cache = caches[ROOM_CACHE_ALIAS]
+    version = cache.get(_visit_version_key(owner_id))
+    if version is not None:
+        snapshot = cache.get(f"room:visit:{owner_id}:{version}")
+        if snapshot is not None:
+            return snapshot
+
+    # Read the version before the rows: a write racing this rebuild can only make the
+    # rows newer than their label, and its own publish moves visitors past this snapshot
+    version = RoomState.objects.filter(owner_id=owner_id).values_list('version', flat=True).first() or 0
+    snapshot = {
+        "ownerID": owner_id,
+        "version": version,
+        "room_items": RoomItem.rows_for_owner(owner_id, placed_only=True),
+    }
+    cache.set(f"room:visit:{owner_id}:{version}", snapshot, ROOM_VISIT_TIMEOUT)
+    # add, not set: never move the pointer back past a version a writer already published
+    cache.add(_visit_version_key(owner_id), version, ROOM_VISIT_TIMEOUT)
+    return snapshot
@@ -0,0 +1,86 @@
+from django.contrib.postgres.lookups import TrigramSimilar
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection
+from django.db.models.functions import Lower
+from .models import User
+
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 50
+TRIGRAM_MIN_LENGTH = 3  # Shorter queries produce too few trigrams to rank usefully
+
+
+def search_users(query, limit=SEARCH_LIMIT, exclude_user_id=None):
+    """
+    Ranked user search returning [{'userID', 'username'}, ...]:
+    exact userID match first, then case-insensitive username prefix matches,
+    then fuzzy matches (trigram similarity on PostgreSQL, substring elsewhere).
+    """
+    query = str(query).strip()
+    lowered = query.lower()
+    limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+    if not query:
+        return []
+
+    users = User.objects.alias(username_lower=Lower('username'))
+    if exclude_user_id is not None:
+        users = users.exclude(userID=exclude_user_id)
+
+    results = []
+    seen = set()
+
+    def collect(rows):
+        for row in rows:
+            if row['userID'] not in seen and len(results) < limit:
+                seen.add(row['userID'])
+                results.append(row)
+
+    if query.isdigit():
+        collect(users.filter(userID=int(query)).values('userID', 'username'))
+
+    # Prefix matches come back in index order, so an exact username sorts first
+    collect(
+        users.filter(username_lower__startswith=lowered)
+        .order_by('username_lower')
+        .values('userID', 'username')[:limit]
+    )
+
+    remaining = limit - len(results)
+    if remaining and len(lowered) >= TRIGRAM_MIN_LENGTH:
+        if connection.vendor == 'postgresql':
+            fuzzy = (
+                users.filter(TrigramSimilar(Lower('username'), lowered))
+                .annotate(similarity=TrigramSimilarity(Lower('username'), lowered))
+                .order_by('-similarity', 'username_lower')
+            )
+        else:
+            fuzzy = users.filter(username_lower__contains=lowered).order_by('username_lower')
+        # Over-fetch by what we already have, since those rows match again here
+        collect(fuzzy.values('userID', 'username')[:remaining + len(results)])
+
+    return results
+
+
+def create_search_indexes(sender, using='default', **kwargs):
+    """
+    post_migrate receiver for the PostgreSQL-only username search indexes:
+    a text_pattern_ops btree on lower(username) for the prefix LIKE (a plain btree
+    cannot serve LIKE under a non-C collation, and trigrams do not help 1-2 character
+    prefixes), and a trigram GIN index for the % similarity operator.
+    """
+    from django.db import connections
+
+    conn = connections[using]
+    if conn.vendor != 'postgresql':
+        return
+
+    table = User._meta.db_table
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS user_username_prefix_idx ON "{table}" '
+            f'(lower("username") text_pattern_ops)'
+        )
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS user_username_trgm_idx ON "{table}" '
+            f'USING gin (lower("username") gin_trgm_ops)'
+        )
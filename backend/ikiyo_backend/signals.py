@@ -0,0 +1,35 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .catalog import bump_catalog_version
+from .friend_cache import invalidate_friend_ids
+from .models import FriendList, Item, RoomItem, RoomState, room_version_changed
+from .rooms import publish_room_version, queue_room_removal
+
+
+@receiver(post_save, sender=FriendList)
+@receiver(post_delete, sender=FriendList)
+def invalidate_friend_cache(sender, instance, **kwargs):
+    # After commit: invalidating earlier lets a concurrent read re-cache the old set for the full TTL
+    user_ids = (instance.from_user_id, instance.to_user_id)
+    transaction.on_commit(lambda: invalidate_friend_ids(*user_ids))
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+def invalidate_catalog(sender, instance, **kwargs):
+    # After commit, so a concurrent read cannot cache the old rows under the new version
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_delete, sender=RoomItem)
+def log_room_item_removal(sender, instance, using='default', **kwargs):
+    # Bulk writes log their own RoomChanges; deletes (including cascades) are logged here,
+    # batched per transaction so removing a stack is one version, not one per copy.
+    # Recorded after commit so a cascading User delete is not blocked by the log.
+    queue_room_removal(instance.item_id, instance.id, using=using)
+
+
+@receiver(room_version_changed, sender=RoomState)
+def refresh_visit_snapshot(sender, owner_id, version, **kwargs):
+    publish_room_version(owner_id, version)
@@ -0,0 +1,193 @@
+import io
+import logging
+import os
+import urllib.parse
+import urllib.request
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import Avatar, AvatarSprite
+
+# Composited avatar sprites are stored content-addressed by Avatar.content_hash, so an
+# avatar that changes gets a new file and an unchanged one is never recomposed. Requests
+# only look sprites up and queue missing ones; compose_avatar_sprites (run periodically)
+# does the slow layer fetching. The least recently served sprites are evicted once the
+# cache grows past AVATAR_SPRITE_MAX_ENTRIES.
+DEFAULT_LAYER_LOADER = 'ikiyo_backend.sprites.fetch_layer'
+SPRITE_TOUCH_INTERVAL = timedelta(minutes=5)
+SPRITE_RETRY_AFTER = timedelta(hours=1)
+LAYER_FETCH_TIMEOUT = 5
+DEFAULT_LAYER_HOSTS = ('res.cloudinary.com',)
+MAX_LAYER_BYTES = 2 * 1024 * 1024
+
+# Canvas and layer placement, mirroring the client's Skia avatar (head at rest).
+# Drawn in order; layers the client does not place yet sit with the head layers.
+SPRITE_SIZE = (200, 300)
+SPRITE_LAYOUT = (
+    ('left_arm', 15, -4, 220, 250),
+    ('right_arm', 0, -10, 220, 250),
+    ('body', 0, 0, 220, 250),
+    ('left_leg', 6, 8, 200, 250),
+    ('right_leg', 13, 8, 200, 250),
+    ('head', -5, -10, 220, 250),
+    ('lowerwear', -5, -10, 220, 250),
+    ('shoes', -5, -10, 220, 250),
+    ('facial_expression', -5, -10, 220, 250),
+    ('face_accessories', -5, -10, 220, 250),
+    ('hat', -5, -10, 220, 250),
+    ('eyes', -6, -12, 220, 250),
+    ('upperwear', -5, -11, 220, 250),
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # A redirect could lead anywhere, so it fails the fetch instead of being followed
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+_layer_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def fetch_layer(url):
+    """
+    Default loader: download a layer image. Layer URLs come from clients, so only https
+    URLs on AVATAR_LAYER_HOSTS are fetched, redirects are refused and the size is capped.
+    """
+    parsed = urllib.parse.urlsplit(url)
+    allowed_hosts = getattr(settings, 'AVATAR_LAYER_HOSTS', DEFAULT_LAYER_HOSTS)
+    if parsed.scheme != 'https' or parsed.hostname not in allowed_hosts or parsed.port not in (None, 443):
+        raise ValueError(f"Refusing to fetch avatar layer from {url!r}.")
+
+    with _layer_opener.open(url, timeout=LAYER_FETCH_TIMEOUT) as response:
+        data = response.read(MAX_LAYER_BYTES + 1)
+    if len(data) > MAX_LAYER_BYTES:
+        raise ValueError(f"Avatar layer {url!r} is larger than {MAX_LAYER_BYTES} bytes.")
+    return data
+
+
+def local_layer_loader(url):
+    """Loader for tests and offline development: serve layers by file name from AVATAR_LAYER_ROOT."""
+    with open(os.path.join(settings.AVATAR_LAYER_ROOT, os.path.basename(url)), 'rb') as layer:
+        return layer.read()
+
+
+@lru_cache(maxsize=256)
+def _load_layer(loader, url):
+    # The same base layers (default head, body, ...) appear in almost every avatar
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(import_string(loader)(url)))
+    return image.convert('RGBA')
+
+
+def compose_sprite(layers):
+    """Flatten an avatar's layer URLs into one PNG (bytes)."""
+    from PIL import Image
+
+    loader = getattr(settings, 'AVATAR_LAYER_LOADER', DEFAULT_LAYER_LOADER)
+    canvas = Image.new('RGBA', SPRITE_SIZE)
+    for field, x, y, width, height in SPRITE_LAYOUT:
+        url = layers.get(field)
+        if url:
+            layer = _load_layer(loader, url).resize((width, height))
+            canvas.alpha_composite(layer, (max(x, 0), max(y, 0)), (max(-x, 0), max(-y, 0)))
+
+    output = io.BytesIO()
+    canvas.save(output, format='PNG', optimize=True)
+    return output.getvalue()
+
+
+def queue_sprites(layer_sets):
+    """Register pending sprites for any of these layer dicts not cached yet (no composing here)."""
+    pending = {}
+    for layers in layer_sets:
+        layers = {field: layers.get(field) for field in Avatar.LAYER_FIELDS}
+        pending.setdefault(Avatar.content_hash(layers), layers)
+    AvatarSprite.objects.bulk_create(
+        [AvatarSprite(content_hash=content_hash, layers=layers) for content_hash, layers in pending.items()],
+        ignore_conflicts=True,
+    )
+
+
+def attach_sprites(avatars):
+    """
+    Set avatar["sprite"] on each avatar payload (see Avatar.layer_rows) to its composed
+    image URL, or None while it is not composed yet (the client draws the layers instead).
+    Missing sprites are queued for compose_avatar_sprites. Costs a few queries, no fetching.
+    """
+    avatars = list(avatars)
+    known = dict(
+        AvatarSprite.objects.filter(content_hash__in={avatar['hash'] for avatar in avatars})
+        .values_list('content_hash', 'ready')
+    )
+    queue_sprites(avatar for avatar in avatars if avatar['hash'] not in known)
+    ready = {content_hash for content_hash, is_ready in known.items() if is_ready}
+
+    # Recency is only refreshed every few minutes, so serving stays a read in the common case
+    if ready:
+        now = timezone.now()
+        AvatarSprite.objects.filter(
+            content_hash__in=ready, last_used_at__lt=now - SPRITE_TOUCH_INTERVAL
+        ).update(last_used_at=now)
+
+    for avatar in avatars:
+        avatar['sprite'] = AvatarSprite.url_for(avatar['hash']) if avatar['hash'] in ready else None
+    return avatars
+
+
+def compose_pending_sprites(limit=100):
+    """
+    Compose up to `limit` pending sprites, most recently requested first. A sprite whose
+    layers cannot be loaded is skipped until SPRITE_RETRY_AFTER has passed.
+    Returns (composed, failed) counts.
+    """
+    now = timezone.now()
+    pending = (
+        AvatarSprite.objects.filter(ready=False)
+        .filter(Q(failed_at__isnull=True) | Q(failed_at__lt=now - SPRITE_RETRY_AFTER))
+        .order_by('-last_used_at')[:limit]
+    )
+
+    storage = AvatarSprite.storage()
+    composed = failed = 0
+    for sprite in pending:
+        try:
+            image = compose_sprite(sprite.layers)
+        except Exception:
+            logger.warning("Could not compose avatar sprite %s", sprite.content_hash, exc_info=True)
+            AvatarSprite.objects.filter(pk=sprite.pk).update(failed_at=now)
+            failed += 1
+            continue
+        name = AvatarSprite.file_name(sprite.content_hash)
+        if not storage.exists(name):
+            storage.save(name, ContentFile(image))
+        AvatarSprite.objects.filter(pk=sprite.pk).update(ready=True, failed_at=None, size=len(image))
+        composed += 1
+
+    if composed:
+        evict_sprites()
+    return composed, failed
+
+
+def evict_sprites(max_entries=None):
+    """Drop the least recently used sprites beyond `max_entries`; returns how many were evicted."""
+    if max_entries is None:
+        max_entries = getattr(settings, 'AVATAR_SPRITE_MAX_ENTRIES', 10000)
+    excess = AvatarSprite.objects.count() - max_entries
+    if excess <= 0:
+        return 0
+
+    stale = list(AvatarSprite.objects.order_by('last_used_at').values_list('content_hash', flat=True)[:excess])
+    storage = AvatarSprite.storage()
+    for content_hash in stale:
+        storage.delete(AvatarSprite.file_name(content_hash))
+    AvatarSprite.objects.filter(content_hash__in=stale).delete()
+    return len(stale)
@@ -0,0 +1,66 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Q
+from .models import FriendList, FriendSuggestion, User
+
+SUGGESTIONS_PER_USER = 20
+
+
+def _adjacency(user_ids, chunk_size=1000):
+    """{userID: set(friend userIDs)} for the given users, loaded chunk by chunk."""
+    user_ids = list(user_ids)
+    adjacency = defaultdict(set)
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        edges = FriendList.objects.filter(
+            Q(from_user_id__in=chunk) | Q(to_user_id__in=chunk),
+            accepted=True
+        ).values_list('from_user_id', 'to_user_id')
+        for low, high in edges:
+            adjacency[low].add(high)
+            adjacency[high].add(low)
+    return adjacency
+
+
+def recompute_suggestions(user_ids, limit=SUGGESTIONS_PER_USER):
+    """
+    Rebuild FriendSuggestion rows for one batch of users, ranked by mutual-friend count.
+    Only the batch's friends and their friends are held in memory.
+    """
+    user_ids = list(user_ids)
+    friends = _adjacency(user_ids)
+    friends_of_friends = _adjacency({friend for user_id in user_ids for friend in friends[user_id]})
+
+    suggestions = []
+    for user_id in user_ids:
+        mutuals = Counter()
+        for friend in friends[user_id]:
+            mutuals.update(friends_of_friends[friend])
+        mutuals.pop(user_id, None)
+        for known in friends[user_id]:
+            mutuals.pop(known, None)
+
+        suggestions.extend(
+            FriendSuggestion(user_id=user_id, candidate_id=candidate, mutual_count=count)
+            for candidate, count in mutuals.most_common(limit)
+        )
+
+    with transaction.atomic():
+        FriendSuggestion.objects.filter(user_id__in=user_ids).delete()
+        FriendSuggestion.objects.bulk_create(suggestions)
+    return len(suggestions)
+
+
+def recompute_all_suggestions(batch_size=500, limit=SUGGESTIONS_PER_USER):
+    """Walk every user in userID order, one batch at a time."""
+    last_id = 0
+    total = 0
+    while True:
+        batch = list(
+            User.objects.filter(userID__gt=last_id).order_by('userID').values_list('userID', flat=True)[:batch_size]
+        )
+        if not batch:
+            return total
+        total += recompute_suggestions(batch, limit=limit)
+        last_id = batch[-1]
@@ -1,3 +1,313 @@
-from django.test import TestCase
+import io
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from rest_framework.test import APIClient
+
+from .catalog import get_catalog_version
+from .friend_cache import get_friend_ids
+from .ledger import InsufficientBalance
+from .models import CurrencyLedger, FriendList, FriendSuggestion, Inventory, Item, Message, RoomItem, RoomState, User
+from .purchases import purchase_item
+from .rooms import OccupancyGrid, find_collisions, room_snapshot
+from .sprites import MAX_LAYER_BYTES, fetch_layer
+
+
+def rect(id, x, y, width=1, height=1, allowOverlap=False):
+    return {'id': id, 'x': x, 'y': y, 'width': width, 'height': height, 'allowOverlap': allowOverlap}
+
+
+class FindCollisionsTests(SimpleTestCase):
+    def test_disjoint_and_touching_rects_do_not_collide(self):
+        self.assertEqual(find_collisions([rect(1, 0, 0, 2, 2), rect(2, 2, 0, 2, 2), rect(3, 0, 2)]), [])
+
+    def test_overlapping_pairs_are_reported_once_and_sorted(self):
+        rects = [rect(3, 0, 0, 5, 5), rect(1, 4, 4, 2, 2), rect(2, 15, 8)]
+        self.assertEqual(find_collisions(rects), [[1, 3]])
+
+    def test_overlap_across_bucket_boundary(self):
+        self.assertEqual(find_collisions([rect(1, 3, 3, 2, 2), rect(2, 4, 4)]), [[1, 2]])
+
+    def test_allow_overlap_on_either_item_skips_the_pair(self):
+        self.assertEqual(find_collisions([rect(1, 0, 0, 3, 3), rect(2, 1, 1, allowOverlap=True)]), [])
+
+    def test_matches_brute_force(self):
+        rects = [rect(n, (n * 7) % 19, (n * 3) % 9, n % 3 + 1, n % 2 + 1) for n in range(40)]
+        expected = sorted(
+            [a['id'], b['id']]
+            for i, a in enumerate(rects) for b in rects[i + 1:]
+            if a['x'] < b['x'] + b['width'] and b['x'] < a['x'] + a['width']
+            and a['y'] < b['y'] + b['height'] and b['y'] < a['y'] + a['height']
+        )
+        self.assertEqual(find_collisions(rects), expected)
+
+    def test_oversized_rects_stay_bounded(self):
+        self.assertEqual(find_collisions([rect(1, 0, 0, 20000, 20000), rect(2, 15000, 15000), rect(3, 30000, 0)]), [[1, 2]])
+
+
+class OccupancyGridTests(SimpleTestCase):
+    def test_empty_grid_places_top_left(self):
+        self.assertEqual(OccupancyGrid(5, 3).find_free(2, 2), (0, 0))
+
+    def test_first_fit_skips_occupied_cells(self):
+        grid = OccupancyGrid(5, 3)
+        grid.occupy(0, 0, 2, 3)
+        grid.occupy(3, 1, 2, 1)
+        self.assertEqual(grid.find_free(3, 1), (2, 0))
+        self.assertEqual(grid.find_free(1, 3), (2, 0))
+        self.assertIsNone(grid.find_free(2, 2))
+
+    def test_too_large_for_room(self):
+        self.assertIsNone(OccupancyGrid(5, 3).find_free(6, 1))
+
+    def test_full_grid_has_no_space(self):
+        grid = OccupancyGrid(4, 2)
+        grid.occupy(0, 0, 4, 2)
+        self.assertIsNone(grid.find_free(1, 1))
+
+    def test_occupy_clips_to_room(self):
+        grid = OccupancyGrid(4, 2)
+        grid.occupy(-2, -1, 4, 2)
+        self.assertEqual(grid.rows, [0b0011, 0])
+        self.assertEqual(grid.find_free(2, 2), (2, 0))
+
+
+class ChatCursorTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.alice = User.objects.create(username='alice', email='alice@example.com', password='x')
+        self.bob = User.objects.create(username='bob', email='bob@example.com', password='x')
+        self.messages = [
+            Message.objects.create(sender=self.bob, recipient=self.alice, content=f"hi {n}") for n in range(3)
+        ]
+
+    def chat(self, **data):
+        return self.client.post('/api/chat/', {'userID': self.alice.userID, 'friend_id': self.bob.userID, **data}, format='json')
+
+    def test_mark_read_up_to_zero_marks_nothing(self):
+        response = self.chat(action='mark_read', up_to_id=0)
+        self.assertEqual(response.json()['marked'], 0)
+        self.assertEqual(Message.objects.filter(is_read=False).count(), 3)
+
+    def test_mark_read_rejects_non_integer(self):
+        self.assertEqual(self.chat(action='mark_read', up_to_id='abc').status_code, 400)
+
+    def test_zero_cursors_are_not_ignored(self):
+        self.assertEqual(self.chat(action='get_messages', before_id=0).json()['messages'], [])
+        after = self.chat(action='get_messages', after_id=0).json()['messages']
+        self.assertEqual([message['id'] for message in after], [message.id for message in self.messages])
+
+
+class FriendCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_accepted_friendship_is_visible_after_commit(self):
+        alice = User.objects.create(username='alice', email='alice@example.com', password='x')
+        bob = User.objects.create(username='bob', email='bob@example.com', password='x')
+        self.assertEqual(get_friend_ids(alice.userID), frozenset())
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            FriendList.objects.create(from_user=alice, to_user=bob, accepted=True)
+            # Not invalidated before commit, so no concurrent read can re-cache the old set
+            self.assertEqual(get_friend_ids(alice.userID), frozenset())
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(get_friend_ids(alice.userID), {bob.userID})
+        self.assertEqual(get_friend_ids(bob.userID), {alice.userID})
+
+
+class GetUsersByIDsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(username='alice', email='alice@example.com', password='secret')
+
+    def batch(self, **data):
+        return self.client.post('/api/user/batch/', {'userIDs': [self.user.userID, 999], **data}, format='json')
+
+    def test_defaults_to_public_fields(self):
+        body = self.batch().json()
+        self.assertEqual(set(body['users'][0]), {'userID', 'username', 'description', 'status', 'buddy'})
+        self.assertEqual(body['missing'], [999])
+
+    def test_rejects_private_and_malformed_fields(self):
+        for fields in (['password'], ['email'], [['username']], 'username', [1]):
+            self.assertEqual(self.batch(fields=fields).status_code, 400, fields)
+
+
+class FriendSuggestionsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create(username='alice', email='alice@example.com', password='x')
+        candidate = User.objects.create(username='bob', email='bob@example.com', password='x')
+        FriendSuggestion.objects.create(user=self.user, candidate=candidate, mutual_count=2)
+
+    def suggestions(self, limit):
+        return self.client.post('/api/friend-action/', {'action': 'suggestions', 'userID': self.user.userID, 'limit': limit}, format='json')
+
+    def test_non_positive_limit_is_clamped(self):
+        for limit in (0, -1):
+            response = self.suggestions(limit)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()['suggestions']), 1)
+
+    def test_non_numeric_limit_is_rejected(self):
+        self.assertEqual(self.suggestions('many').status_code, 400)
+
+
+class CatalogVersionTests(TestCase):
+    def test_item_save_bumps_version_after_commit(self):
+        before = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            Item.objects.create(item_name='Chair', price=5, category='room')
+            self.assertEqual(get_catalog_version(), before)
+        self.assertNotEqual(get_catalog_version(), before)
+
+
+class PurchaseDebitTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='alice', email='alice@example.com', password='x', gold=25)
+        self.item = Item.objects.create(item_name='Hat', price=10, category='avatar')
+
+    def test_sequential_purchases_debit_and_stack(self):
+        purchase_item(self.user.userID, self.item.item_id)
+        purchase_item(self.user.userID, self.item.item_id)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.gold, 5)
+        self.assertEqual(Inventory.objects.get(owner=self.user, item=self.item).quantity, 2)
+
+    def test_overdraft_is_rejected_and_balance_unchanged(self):
+        self.user.gold = 9
+        self.user.save()
+
+        with self.assertRaises(InsufficientBalance):
+            purchase_item(self.user.userID, self.item.item_id)
+
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.gold, self.user.rubby), (9, 0))
+        self.assertFalse(Inventory.objects.filter(owner=self.user).exists())
+        self.assertFalse(CurrencyLedger.objects.exists())
+
+    def test_purchase_writes_ledger_entry(self):
+        purchase_item(self.user.userID, self.item.item_id)
+
+        entry = CurrencyLedger.objects.get()
+        self.assertEqual(
+            (entry.user_id, entry.currency, entry.amount, entry.reason, entry.reference),
+            (self.user.userID, 'gold', -10, 'purchase', f"item:{self.item.item_id}"),
+        )
+
+
+class FetchLayerTests(SimpleTestCase):
+    def test_refuses_other_schemes_and_hosts(self):
+        for url in (
+            'file:///etc/passwd',
+            'http://res.cloudinary.com/a.png',
+            'https://169.254.169.254/latest/meta-data',
+            'https://res.cloudinary.com.evil.example/a.png',
+            'https://res.cloudinary.com:8443/a.png',
+        ):
+            with mock.patch('ikiyo_backend.sprites._layer_opener') as opener:
+                with self.assertRaises(ValueError, msg=url):
+                    fetch_layer(url)
+                opener.open.assert_not_called()
+
+    def test_caps_layer_size(self):
+        with mock.patch('ikiyo_backend.sprites._layer_opener') as opener:
+            opener.open.return_value = io.BytesIO(b'x' * (MAX_LAYER_BYTES + 10))
+            with self.assertRaises(ValueError):
+                fetch_layer('https://res.cloudinary.com/a.png')
+
+            opener.open.return_value = io.BytesIO(b'png')
+            self.assertEqual(fetch_layer('https://res.cloudinary.com/a.png'), b'png')
+
+
+class RoomSyncTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create(username='alice', email='alice@example.com', password='x')
+        self.chair = Item.objects.create(item_name='Chair', price=1, category='room', part='chair')
+        self.lamp = Item.objects.create(item_name='Lamp', price=1, category='room', part='lamp')
+        self.hat = Item.objects.create(item_name='Hat', price=1, category='avatar', part='hat')
+        Inventory.add_items(self.owner.userID, {self.chair.item_id: 2, self.lamp.item_id: 1, self.hat.item_id: 1})
+
+    def room_ids(self, item):
+        return list(RoomItem.objects.filter(item__item=item).order_by('id').values_list('id', flat=True))
+
+    def test_creates_one_room_item_per_copy(self):
+        self.assertEqual(RoomItem.sync_for_owner(self.owner.userID), 3)
+        self.assertEqual((len(self.room_ids(self.chair)), len(self.room_ids(self.lamp))), (2, 1))
+        self.assertEqual(self.room_ids(self.hat), [])
+        self.assertEqual(RoomItem.sync_for_owner(self.owner.userID), 0)
+
+    def test_growing_a_stack_keeps_existing_rows(self):
+        RoomItem.sync_for_owner(self.owner.userID)
+        chairs, lamps = self.room_ids(self.chair), self.room_ids(self.lamp)
+
+        Inventory.add_items(self.owner.userID, {self.chair.item_id: 3})
+        self.assertEqual(RoomItem.sync_for_owner(self.owner.userID), 3)
+
+        self.assertEqual(self.room_ids(self.chair)[:2], chairs)
+        self.assertEqual(len(self.room_ids(self.chair)), 5)
+        self.assertEqual(self.room_ids(self.lamp), lamps)
+
+    def test_shrinking_a_stack_drops_unplaced_surplus_first(self):
+        Inventory.add_items(self.owner.userID, {self.chair.item_id: 1})
+        RoomItem.sync_for_owner(self.owner.userID)
+        first, second, third = self.room_ids(self.chair)
+        lamps = self.room_ids(self.lamp)
+        RoomItem.objects.filter(id__in=[first, third]).update(placed=True)
+
+        Inventory.objects.filter(owner=self.owner, item=self.chair).update(quantity=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(RoomItem.sync_for_owner(self.owner.userID), 0)
+
+        self.assertEqual(self.room_ids(self.chair), [first])
+        self.assertEqual(self.room_ids(self.lamp), lamps)
+
+
+class RoomRemovalLogTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create(username='alice', email='alice@example.com', password='x')
+        self.chair = Item.objects.create(item_name='Chair', price=1, category='room', part='chair')
+        Inventory.add_items(self.owner.userID, {self.chair.item_id: 4})
+        with self.captureOnCommitCallbacks(execute=True):
+            RoomItem.sync_for_owner(self.owner.userID)
+        self.ids = list(RoomItem.objects.order_by('id').values_list('id', flat=True))
+
+    def version(self):
+        return RoomState.objects.values_list('version', flat=True).get(owner=self.owner)
+
+    def test_one_delete_logs_one_version(self):
+        since = self.version()
+        with self.captureOnCommitCallbacks(execute=True):
+            RoomItem.objects.filter(id__in=self.ids[:2]).delete()
+
+        self.assertEqual(self.version(), since + 1)
+        snapshot = room_snapshot(self.owner.userID, since)
+        self.assertEqual((snapshot['full'], snapshot['changed'], snapshot['removed']), (False, [], self.ids[:2]))
+
+    def test_reused_queryset_logs_each_transaction(self):
+        since = self.version()
+        unplaced = RoomItem.objects.filter(placed=False)
+        RoomItem.objects.filter(id__in=self.ids[1:]).update(placed=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            unplaced.delete()
+
+        RoomItem.objects.filter(id=self.ids[1]).update(placed=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            unplaced.delete()
+
+        self.assertEqual(self.version(), since + 2)
+        self.assertEqual(room_snapshot(self.owner.userID, since + 1)['removed'], [self.ids[1]])
+
+    def test_deletes_in_one_transaction_share_a_version(self):
+        since = self.version()
+        with self.captureOnCommitCallbacks(execute=True):
+            RoomItem.objects.filter(id=self.ids[0]).delete()
+            RoomItem.objects.get(id=self.ids[1]).delete()
+
+        self.assertEqual(self.version(), since + 1)
+        self.assertEqual(room_snapshot(self.owner.userID, since)['removed'], self.ids[:2])
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import UserViewSet, LoginView, EditUserView,ItemListView, GetUserByIDView, BuyItemView, UserInventoryView, DisplayInventoryAvatar,DisplayInventoryRoom, BuddyRequestView, TaskActionView, FriendActionView, ChatView,RetrieveAvatarView, GameInfoView, RoomView
+from .views import UserViewSet, LoginView, EditUserView,ItemListView, GetUserByIDView, GetUsersByIDsView, BuyItemView, CheckoutView, UserInventoryView, InventoryListView, DisplayInventoryAvatar,DisplayInventoryRoom, BuddyRequestView, TaskActionView, FriendActionView, ChatView, PresenceView, RetrieveAvatarView, RetrieveAvatarsView, GameInfoView, RoomView, VisitRoomView
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet, basename='user')
@@ -11,15 +11,21 @@ urlpatterns = [
     path("edit-user/<int:user_id>/", EditUserView.as_view(), name="edit-user"),#patch
     path('items/', ItemListView.as_view(), name='item-list'),  # Endpoint: /api/items/
     path('user/', GetUserByIDView.as_view(), name='get-user-by-id'),  # Endpoint to get user by ID using POST
+    path('user/batch/', GetUsersByIDsView.as_view(), name='get-users-by-ids'),  # Many users in one POST
     path('buy-item/', BuyItemView.as_view(), name='buy-item'),  # Add the route for buying an item
+    path('checkout/', CheckoutView.as_view(), name='checkout'),  # Buy a whole cart in one request
     path('user-inventory/', UserInventoryView.as_view(), name='user-inventory'),
+    path('inventory/', InventoryListView.as_view(), name='inventory'),  # Optional category filter
     path('display-inventory-room/', DisplayInventoryRoom.as_view(), name='display-inventory-room'),
     path('display-inventory-avatar/', DisplayInventoryAvatar.as_view(), name='display-inventory-avatar'),
     path('buddy/', BuddyRequestView.as_view(), name='buddy-request'),
     path('task-action/', TaskActionView.as_view(), name='task-action'),
     path('friend-action/', FriendActionView.as_view(), name='friend-action'),
     path('chat/', ChatView.as_view(), name='chat'),
+    path('presence/', PresenceView.as_view(), name='presence'),
     path('retrieve-avatar/', RetrieveAvatarView.as_view(), name='retrieve-avatar'),
+    path('retrieve-avatar/batch/', RetrieveAvatarsView.as_view(), name='retrieve-avatars'),  # Many avatars in one POST
     path('gameinfo/', GameInfoView.as_view()),
     path('room/', RoomView.as_view(), name='room-view'),
+    path('room/visit/', VisitRoomView.as_view(), name='visit-room'),  # A friend's room, read-only and cached
 ]
\ No newline at end of file
@@ -4,12 +4,24 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from django.contrib.auth import authenticate
-from .models import User, Item, Inventory, PartnerRequest,Task, FriendList, FriendRequest, Message, Avatar, GameInfo,RoomItem
-from .serializers import UserSerializer, LoginSerializer, ItemSerializer, TaskSerializer, MessageSerializer, GameInfoSerializer,RoomItemSerializer
+from .models import User, Item, Inventory, PartnerRequest,Task, FriendList, FriendRequest, FriendSuggestion, Message, ConversationSummary, Avatar, GameInfo,RoomItem, RoomChange
+from .serializers import UserSerializer, LoginSerializer, TaskSerializer, MessageSerializer, GameInfoSerializer,RoomItemSerializer
 from django.shortcuts import get_object_or_404
-import json
-from django.db.models import Q
+from django.db.models import Q, F
+from django.db.models.functions import Greatest, Lower
+from django.db import transaction
 from django.core.exceptions import ValidationError
+from django.utils.http import parse_etags
+from .consumers import broadcast_message, broadcast_read
+from .friend_cache import are_friends, get_friend_ids
+from .search import SEARCH_LIMIT, search_users
+from .presence import PRESENCE_STATES, get_presence, heartbeat
+from .suggestions import SUGGESTIONS_PER_USER
+from .ledger import InsufficientBalance, credit
+from .purchases import checkout, purchase_item
+from .sprites import attach_sprites, queue_sprites
+from .rooms import LayoutConflict, auto_place, room_snapshot, save_layout, visit_snapshot
+from .catalog import CATALOG_PAGE_SIZE, MAX_CATALOG_PAGE_SIZE, get_catalog, get_catalog_page, get_catalog_version
 
 
 # User ViewSet
@@ -64,21 +76,42 @@ class EditUserView(APIView):
 
 class ItemListView(APIView):
     def get(self, request):
-        items = Item.objects.all()  # Retrieve all items
-        serializer = ItemSerializer(items, many=True)  # Serialize the data
-        return Response(serializer.data, status=status.HTTP_200_OK)  # Return JSON response
+        version = get_catalog_version()
+        etag = f'"{version}"'
+
+        category = request.query_params.get('category')
+        part = request.query_params.get('part')
+        after = request.query_params.get('after')
+        limit = request.query_params.get('limit')
+        paginated = any(param is not None for param in (category, part, after, limit))
+
+        if paginated:
+            try:
+                after = int(after) if after else None
+                limit = min(int(limit or CATALOG_PAGE_SIZE), MAX_CATALOG_PAGE_SIZE)
+            except ValueError:
+                return Response({"detail": "after and limit must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+            if limit < 1:
+                return Response({"detail": "limit must be positive."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Unchanged catalog: answer 304 without touching the database
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        elif paginated:
+            # One tab at a time: ?category=Room&part=...&after=<item_id>&limit=...
+            items, next_after = get_catalog_page(version, category, part, after, limit)
+            response = Response({"items": items, "next_after": next_after}, status=status.HTTP_200_OK)
+        else:
+            _, items = get_catalog(version)  # Serialized once per catalog version
+            response = Response(items, status=status.HTTP_200_OK)
+
+        response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'  # Clients may store it but must revalidate
+        return response
     
 class GetUserByIDView(APIView):
     def post(self, request):
-        
-        try:
-            data = json.loads(request.body)  # Debugging
-            print("Received data:", data)  # Log request body
-        except json.JSONDecodeError:
-            return Response({"detail": "Invalid JSON"}, status=status.HTTP_400_BAD_REQUEST)
-        
         user_id = request.data.get('userID')  # Get the userID from the request data
-        print("Extracted userID:", user_id)  # Debugging
 
         if not user_id:
             return Response({"detail": "userID is required."}, status=status.HTTP_400_BAD_REQUEST)
@@ -91,38 +124,91 @@ class GetUserByIDView(APIView):
         except User.DoesNotExist:
             return Response({"detail": "User not found."}, status=status.HTTP_404_NOT_FOUND)  # Handle case where user doesn't exist
 
+class GetUsersByIDsView(APIView):
+    max_batch_size = 100
+    # Public profile columns only: never email, password or balances
+    public_fields = ['userID', 'username', 'description', 'status', 'buddy']
+
+    def post(self, request):
+        user_ids = request.data.get('userIDs')
+        fields = request.data.get('fields')  # Optional sparse field list
+
+        if not isinstance(user_ids, list) or not user_ids:
+            return Response({"detail": "userIDs must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(user_ids) > self.max_batch_size:
+            return Response({"detail": f"At most {self.max_batch_size} userIDs per request."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            user_ids = list(dict.fromkeys(int(user_id) for user_id in user_ids))  # Dedupe, keep order
+        except (TypeError, ValueError):
+            return Response({"detail": "userIDs must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if fields is None:
+            fields = self.public_fields
+        elif (
+            not isinstance(fields, list)
+            or not all(isinstance(field, str) for field in fields)
+            or not set(fields) <= set(self.public_fields)
+        ):
+            return Response({"detail": f"fields must be a list drawn from {self.public_fields}."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # One id__in query projecting only the requested columns (userID is always returned)
+        columns = list(dict.fromkeys(['userID', *fields]))
+        found = {row['userID']: row for row in User.objects.filter(userID__in=user_ids).values(*columns)}
+
+        users = [found[user_id] for user_id in user_ids if user_id in found]
+        missing = [user_id for user_id in user_ids if user_id not in found]
+        return Response({"users": users, "missing": missing}, status=status.HTTP_200_OK)
+
 class BuyItemView(APIView):
     def post(self, request):
         user_id = request.data.get("userID")
         item_id = request.data.get("item_id")
-        price = request.data.get("price")
 
-        if not user_id or not item_id or not price:
+        if not user_id or not item_id:
             return Response({"detail": "Missing required fields."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Get the user and item
-        user = get_object_or_404(User, userID=user_id)
-        item = get_object_or_404(Item, item_id=item_id)
+        # The charge is always the catalog price; a client-sent "price" is ignored
+        try:
+            purchase_item(user_id, item_id)
+        except (User.DoesNotExist, Item.DoesNotExist):
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        except InsufficientBalance:
+            return Response({"detail": "Insufficient balance."}, status=status.HTTP_400_BAD_REQUEST)
+        except (TypeError, ValueError):
+            return Response({"detail": "userID and item_id must be integers."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Convert price to a float (in case it's sent as a string)
-        price = float(price)
+        return Response({"message": "Item purchased successfully."}, status=status.HTTP_200_OK)
+    
 
-        # Determine if the user can afford the item
-        if user.gold >= price:
-            user.gold -= price  # Deduct gold
-        elif user.rubby >= price:
-            user.rubby -= price  # Deduct rubby
-        else:
-            return Response({"detail": "Insufficient balance."}, status=status.HTTP_400_BAD_REQUEST)
+class CheckoutView(APIView):
+    max_cart_size = 100
 
-        # Save the updated user balance
-        user.save()
+    def post(self, request):
+        user_id = request.data.get("userID")
+        item_ids = request.data.get("item_ids")
 
-        # Add item to inventory
-        Inventory.objects.create(owner=user, item=item)
+        if not user_id or not isinstance(item_ids, list) or not item_ids:
+            return Response({"detail": "userID and a non-empty item_ids list are required."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(item_ids) > self.max_cart_size:
+            return Response({"detail": f"At most {self.max_cart_size} items per checkout."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            item_ids = [int(item_id) for item_id in item_ids]
+            currency, total = checkout(user_id, item_ids)
+        except (User.DoesNotExist, Item.DoesNotExist):
+            return Response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+        except InsufficientBalance:
+            return Response({"detail": "Insufficient balance."}, status=status.HTTP_400_BAD_REQUEST)
+        except (TypeError, ValueError):
+            return Response({"detail": "userID and item_ids must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            "message": f"{len(item_ids)} item(s) purchased successfully.",
+            "total": str(total),  # Same decimal string format as Item.price
+            "currency": currency,
+        }, status=status.HTTP_200_OK)
 
-        return Response({"message": "Item purchased successfully."}, status=status.HTTP_200_OK)
-    
 
 class UserInventoryView(APIView):
     def post(self, request):
@@ -133,15 +219,38 @@ class UserInventoryView(APIView):
 
         try:
             user = User.objects.get(userID=user_id)  # Check if user exists
-            inventory_items = Inventory.objects.filter(owner=user)  # Get items owned by the user
-            item_ids = [inventory.item.item_id for inventory in inventory_items]  # Extract item IDs
+            # One row per distinct item owned, no Item fetches
+            stacks = dict(Inventory.objects.filter(owner=user).values_list('item_id', 'quantity'))
 
-            return Response({"userID": user_id, "owned_items": item_ids}, status=status.HTTP_200_OK)
+            return Response({"userID": user_id, "owned_items": list(stacks), "quantities": stacks}, status=status.HTTP_200_OK)
 
         except User.DoesNotExist:
             return Response({"detail": "User not found."}, status=status.HTTP_404_NOT_FOUND)
         
 
+def inventory_items(user_id, category=None):
+    items = list(Inventory.item_rows(user_id, category))
+    for item in items:
+        item['price'] = str(item['price'])  # Same decimal string format as ItemSerializer
+    return items
+
+
+class InventoryListView(APIView):
+    def post(self, request):
+        user_id = request.data.get('userID')
+        category = request.data.get('category')  # Optional, e.g. "Room" or "Avatar"
+
+        if not user_id:
+            return Response({"detail": "userID is required."}, status=status.HTTP_400_BAD_REQUEST)
+        if category is not None and not isinstance(category, str):
+            return Response({"detail": "category must be a string."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if not User.objects.filter(userID=user_id).exists():
+            return Response({"detail": "User not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({"userID": user_id, "items": inventory_items(user_id, category)}, status=status.HTTP_200_OK)
+
+
 class DisplayInventoryRoom(APIView):
     def post(self, request):
         user_id = request.data.get('userID')  # Get userID from the request
@@ -149,20 +258,12 @@ class DisplayInventoryRoom(APIView):
         if not user_id:
             return Response({"detail": "userID is required."}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            # Check if user exists
-            user = User.objects.get(userID=user_id)
-            # Get inventory items for this user and filter by category 'furniture'
-            inventory_items = Inventory.objects.filter(owner=user)
-            furniture_items = [inventory.item for inventory in inventory_items if inventory.item.category.lower() == 'furniture']
-            
-            # Serialize the filtered items
-            serializer = ItemSerializer(furniture_items, many=True)
-            return Response({"userID": user_id, "furniture_items": serializer.data}, status=status.HTTP_200_OK)
-
-        except User.DoesNotExist:
+        if not User.objects.filter(userID=user_id).exists():
             return Response({"detail": "User not found."}, status=status.HTTP_404_NOT_FOUND)
 
+        furniture_items = inventory_items(user_id, 'furniture')
+        return Response({"userID": user_id, "furniture_items": furniture_items}, status=status.HTTP_200_OK)
+
 
 class DisplayInventoryAvatar(APIView):
     def post(self, request):
@@ -171,19 +272,12 @@ class DisplayInventoryAvatar(APIView):
         if not user_id:
             return Response({"detail": "userID is required."}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            # Check if user exists
-            user = User.objects.get(userID=user_id)
-            # Get inventory items for this user and filter by category 'accessories'
-            inventory_items = Inventory.objects.filter(owner=user)
-            accessories_items = [inventory.item for inventory in inventory_items if inventory.item.category.lower() == 'avatar']
-            
-            # Serialize the filtered items
-            serializer = ItemSerializer(accessories_items, many=True)
-            return Response({"userID": user_id, "accessories_items": serializer.data}, status=status.HTTP_200_OK)
-
-        except User.DoesNotExist:
+        if not User.objects.filter(userID=user_id).exists():
             return Response({"detail": "User not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        accessories_items = inventory_items(user_id, 'avatar')
+        return Response({"userID": user_id, "accessories_items": accessories_items}, status=status.HTTP_200_OK)
+
     
     
 class BuddyRequestView(APIView):
@@ -334,18 +428,24 @@ class BuddyRequestView(APIView):
             return Response({'error': 'target_id or username is required for search.'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            # Use Q to filter by either userID or username
-            user = User.objects.filter(
-                Q(userID=target_id) | Q(username__iexact=username)
+            # Match either the userID or the exact username (via the lower(username) index)
+            match = Q()
+            if target_id:
+                match |= Q(userID=target_id)
+            if username:
+                match |= Q(username_lower=username.lower())
+
+            user = User.objects.alias(username_lower=Lower('username')).filter(match).values(
+                'userID', 'username', 'buddy_id'
             ).first()
 
             if not user:
                 return Response({'error': 'User not found.'}, status=status.HTTP_404_NOT_FOUND)
 
             data = {
-                'userID': user.userID,
-                'username': user.username,
-                'buddy_id': user.buddy.userID if user.buddy else None,
+                'userID': user['userID'],
+                'username': user['username'],
+                'buddy_id': user['buddy_id'],
             }
             return Response({'user': data}, status=status.HTTP_200_OK)
         except Exception as e:
@@ -521,13 +621,13 @@ class TaskActionView(APIView):
             if task.status != "Complete" or not task.verification:
                 return Response({"error": "Task must be complete and verified to claim reward."}, status=status.HTTP_400_BAD_REQUEST)
 
-            if hasattr(user, 'gold'):
-                user.gold += task.reward
-                user.save()
-                task.delete()
-                return Response({"message": f"Reward of {task.reward} gold claimed successfully and task deleted."}, status=status.HTTP_200_OK)
-            else:
-                return Response({"error": "User does not have a 'gold' field."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            with transaction.atomic():
+                # Deleting first means a concurrent second claim finds nothing to pay out
+                if not Task.objects.filter(id=task.id).delete()[0]:
+                    return Response({"error": "Reward already claimed."}, status=status.HTTP_400_BAD_REQUEST)
+                credit(user.userID, 'gold', task.reward, reason='task_reward', reference=f"task:{task.id}")
+
+            return Response({"message": f"Reward of {task.reward} gold claimed successfully and task deleted."}, status=status.HTTP_200_OK)
 
         else:
             return Response({"error": "Invalid action. Use 'create', 'edit', or 'delete'."}, status=status.HTTP_400_BAD_REQUEST)
@@ -537,7 +637,6 @@ class FriendActionView(APIView):
     def post(self, request):
         action = request.data.get('action')
         user_id = request.data.get('userID')
-        print("Incoming action:", request.data.get('action'))
 
         if not user_id:
             return Response({"error": "userID is required."}, status=status.HTTP_400_BAD_REQUEST)
@@ -576,26 +675,42 @@ class FriendActionView(APIView):
             request_id = request.data.get('request_id')
             friend_request = get_object_or_404(FriendRequest, id=request_id, to_user=user)
 
-            # Save accepted friendship
-            FriendList.objects.create(from_user=friend_request.from_user, to_user=friend_request.to_user, accepted=True)
+            # Save accepted friendship (a no-op if the other side already accepted one)
+            low, high = FriendList.canonical_pair(friend_request.from_user_id, friend_request.to_user_id)
+            FriendList.objects.update_or_create(from_user_id=low, to_user_id=high, defaults={'accepted': True})
             friend_request.delete()
             return Response({"message": "Friend request accepted."}, status=status.HTTP_200_OK)
 
-       # ===== VIEW FRIENDS =====
-        elif action == 'friends':
-            friends = FriendList.objects.filter(
-                Q(from_user=user) | Q(to_user=user),
-                accepted=True
-            )
-            friend_data = []
-            for friend in friends:
-                other_user = friend.to_user if friend.from_user == user else friend.from_user
-                serialized_user = UserSerializer(other_user).data
-                friend_data.append(serialized_user)
-            
+        # ===== VIEW FRIENDS =====
+        elif action in ('view_friends', 'friends'):
+            friend_data = list(FriendList.friend_rows(user.userID))
+
+            # Live status comes from heartbeats; User.status is only the last flushed value
+            presence = get_presence([friend['userID'] for friend in friend_data])
+            for friend in friend_data:
+                friend['status'] = presence[friend['userID']]
+
             return Response({"friends": friend_data}, status=status.HTTP_200_OK)
-                
-        
+         
+         
+        # ===== PEOPLE YOU MAY KNOW =====
+        elif action == 'suggestions':
+            try:
+                limit = max(1, min(int(request.data.get('limit', 10)), SUGGESTIONS_PER_USER))
+            except (TypeError, ValueError):
+                return Response({"error": "limit must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+            suggestions = FriendSuggestion.objects.filter(user=user).order_by('-mutual_count').values(
+                'mutual_count',
+                userID=F('candidate_id'),
+                username=F('candidate__username'),
+            )[:limit]
+
+            # Drop anyone who became a friend since the last recompute
+            friend_ids = get_friend_ids(user.userID)
+            results = [suggestion for suggestion in suggestions if suggestion['userID'] not in friend_ids]
+            return Response({"suggestions": results}, status=status.HTTP_200_OK)
+
          # ===== VIEW FRIENDS_REQUEST =====
         elif action == 'view_friend_requests':
             requests = FriendRequest.objects.filter(to_user=user)
@@ -609,234 +724,220 @@ class FriendActionView(APIView):
                 })
             return Response({"friend_requests": request_list}, status=status.HTTP_200_OK)
         # ===== SEARCH USER =====
-        elif action == "search":
+        elif action == 'search_user':
             query = request.data.get('query')
 
             if not query:
                 return Response({"error": "Search query is required."}, status=status.HTTP_400_BAD_REQUEST)
 
-            users = User.objects.filter(
-                (Q(userID__icontains=query) | Q(username__icontains=query)) & ~Q(userID=user.userID)
-            ).values('userID', 'username')
+            try:
+                limit = int(request.data.get('limit', SEARCH_LIMIT))
+            except (TypeError, ValueError):
+                return Response({"error": "limit must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
 
-            return Response({"results": list(users)}, status=status.HTTP_200_OK)
+            return Response({"results": search_users(query, limit=limit)}, status=status.HTTP_200_OK)
 
         else:
-            print(f"Unknown action received: '{action}'")
-            return Response({"error": f"Invalid action '{action}'."}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({"error": "Invalid action. Use 'add_friend', 'decline_friend', 'remove_request', 'accept_friend', or 'view_friends'."}, status=status.HTTP_400_BAD_REQUEST)
+
 
 class ChatView(APIView):
+    page_size = 50
+    max_page_size = 100
+
     def post(self, request):
         action = request.data.get('action')
         user_id = request.data.get('userID')
-        user = get_object_or_404(User, userID=user_id)
 
+        # Hot path: friendship comes from the cached friend set
         if action == 'send_message':
-            recipient_id = request.data.get('recipient_id')
-            content = request.data.get('content')
-
-            if not all([recipient_id, content]):
-                return Response({"error": "recipient_id and content are required."}, status=status.HTTP_400_BAD_REQUEST)
-
-            recipient = get_object_or_404(User, userID=recipient_id)
-
-            # Check if they are friends
-            is_friend = FriendList.objects.filter(
-                (Q(from_user=user, to_user=recipient) | Q(from_user=recipient, to_user=user)),
-                accepted=True
-            ).exists()
-
-            if not is_friend:
-                return Response({"error": "You can only chat with friends."}, status=status.HTTP_403_FORBIDDEN)
+            return self.send_message(request, user_id)
+        elif action == 'get_friend_data':
+            return self.get_friend_data(request, user_id)
 
-            message = Message.objects.create(sender=user, recipient=recipient, content=content)
-            serializer = MessageSerializer(message)
-            return Response({"message": "Message sent.", "data": serializer.data}, status=status.HTTP_201_CREATED)
+        user = get_object_or_404(User, userID=user_id)
 
-        elif action == 'get_messages':
+        if action == 'get_messages':
             friend_id = request.data.get('friend_id')
             if not friend_id:
                 return Response({"error": "friend_id is required."}, status=status.HTTP_400_BAD_REQUEST)
 
             friend = get_object_or_404(User, userID=friend_id)
 
-            # Get messages between the two users
-            messages = Message.objects.filter(
-                (Q(sender=user, recipient=friend) | Q(sender=friend, recipient=user))
-            ).order_by('timestamp')
-
-            serializer = MessageSerializer(messages, many=True)
-            return Response({"messages": serializer.data}, status=status.HTTP_200_OK)
-
-        else:
-            return Response({"error": "Invalid action. Use 'create', 'edit', or 'delete'."}, status=status.HTTP_400_BAD_REQUEST)
-
-class FriendActionView(APIView):
-    def post(self, request):
-        action = request.data.get('action')
-        user_id = request.data.get('userID')
-
-        if not user_id:
-            return Response({"error": "userID is required."}, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                limit = min(int(request.data.get('limit', self.page_size)), self.max_page_size)
+                before_id = request.data.get('before_id')
+                after_id = request.data.get('after_id')
+                before_id = int(before_id) if before_id is not None else None
+                after_id = int(after_id) if after_id is not None else None
+            except (TypeError, ValueError):
+                return Response({"error": "limit, before_id and after_id must be integers."}, status=status.HTTP_400_BAD_REQUEST)
 
-        user = get_object_or_404(User, userID=user_id)
+            if limit < 1:
+                return Response({"error": "limit must be positive."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # ===== ADD FRIEND =====
-        if action == 'add_friend':
-            to_user_id = request.data.get('to_user_id')
-            if not to_user_id:
-                return Response({"error": "to_user_id is required."}, status=status.HTTP_400_BAD_REQUEST)
-            to_user = get_object_or_404(User, userID=to_user_id)
-
-            if FriendRequest.objects.filter(from_user=user, to_user=to_user).exists():
-                return Response({"error": "Friend request already sent."}, status=status.HTTP_400_BAD_REQUEST)
-
-            FriendRequest.objects.create(from_user=user, to_user=to_user)
-            return Response({"message": "Friend request sent."}, status=status.HTTP_201_CREATED)
-
-        # ===== DECLINE FRIEND =====
-        elif action == 'decline_friend':
-            request_id = request.data.get('request_id')
-            friend_request = get_object_or_404(FriendRequest, id=request_id, to_user=user)
-            friend_request.delete()
-            return Response({"message": "Friend request declined."}, status=status.HTTP_200_OK)
+            # Every page is a range scan on (conversation_key, id)
+            messages = Message.objects.filter(
+                conversation_key=Message.conversation_key_for(user.userID, friend.userID)
+            )
 
-        # ===== REMOVE REQUEST =====
-        elif action == 'remove_request':
-            request_id = request.data.get('request_id')
-            friend_request = get_object_or_404(FriendRequest, id=request_id, from_user=user)
-            friend_request.delete()
-            return Response({"message": "Friend request canceled."}, status=status.HTTP_200_OK)
+            if after_id is not None:
+                # Newer messages, oldest first (catching up after a known message)
+                page = list(messages.filter(id__gt=after_id).order_by('id')[:limit + 1])
+                has_more = len(page) > limit
+                page = page[:limit]
+            else:
+                # Latest page, or older history when scrolling back with before_id
+                if before_id is not None:
+                    messages = messages.filter(id__lt=before_id)
+                page = list(messages.order_by('-id')[:limit + 1])
+                has_more = len(page) > limit
+                page = page[:limit][::-1]
+
+            serializer = MessageSerializer(page, many=True)
+            return Response({
+                "messages": serializer.data,
+                "has_more": has_more,
+                "next_before_id": page[0].id if page else None,
+                "next_after_id": page[-1].id if page else after_id,
+            }, status=status.HTTP_200_OK)
+        
+        elif action == 'mark_read':
+            friend_id = request.data.get('friend_id')
+            up_to_id = request.data.get('up_to_id')  # Optional: defaults to the whole conversation
+            if not friend_id:
+                return Response({"error": "friend_id is required."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # ===== ACCEPT FRIEND =====
-        elif action == 'accept_friend':
-            request_id = request.data.get('request_id')
-            friend_request = get_object_or_404(FriendRequest, id=request_id, to_user=user)
+            try:
+                up_to_id = int(up_to_id) if up_to_id is not None else None
+            except (TypeError, ValueError):
+                return Response({"error": "up_to_id must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Save accepted friendship
-            FriendList.objects.create(from_user=friend_request.from_user, to_user=friend_request.to_user, accepted=True)
-            friend_request.delete()
-            return Response({"message": "Friend request accepted."}, status=status.HTTP_200_OK)
+            friend = get_object_or_404(User, userID=friend_id)
 
-        # ===== VIEW FRIENDS =====
-        elif action == 'view_friends':
-            friends = FriendList.objects.filter(
-                Q(from_user=user) | Q(to_user=user),
-                accepted=True
+            unread = Message.objects.filter(
+                conversation_key=Message.conversation_key_for(user.userID, friend.userID),
+                recipient=user,
+                is_read=False,
             )
-            friend_data = []
-            for friend in friends:
-                if friend.from_user == user:
-                    other_user = friend.to_user
-                else:
-                    other_user = friend.from_user
-
-                friend_data.append({
-                    'userID': other_user.userID,
-                    'username': other_user.username,
-                    'status': other_user.status
-                })
-
-            return Response({"friends": friend_data}, status=status.HTTP_200_OK)
-         
-         
-         # ===== VIEW FRIENDS_REQUEST =====
-        elif action == 'view_friend_requests':
-            requests = FriendRequest.objects.filter(to_user=user)
-            request_list = []
-            for fr in requests:
-                request_list.append({
-                    "request_id": fr.id,
-                    "from_user_id": fr.from_user.userID,
-                    "from_username": fr.from_user.username,
-                    "created_at": fr.created_at
-                })
-            return Response({"friend_requests": request_list}, status=status.HTTP_200_OK)
-        # ===== SEARCH USER =====
-        elif action == 'search_user':
-            query = request.data.get('query')
-
-            if not query:
-                return Response({"error": "Search query is required."}, status=status.HTTP_400_BAD_REQUEST)
+            if up_to_id is not None:
+                unread = unread.filter(id__lte=up_to_id)
+
+            # One UPDATE for the whole range, no per-row saves
+            with transaction.atomic():
+                marked = unread.update(is_read=True)
+                if marked:
+                    ConversationSummary.objects.filter(owner=user, friend=friend).update(
+                        unread_count=Greatest(F('unread_count') - marked, 0)
+                    )
 
-            users = User.objects.filter(
-                Q(userID__icontains=query) | Q(username__icontains=query)
-            ).values('userID', 'username')
+            if marked:
+                broadcast_read(user.userID, friend.userID, up_to_id)
+            return Response({"message": f"{marked} message(s) marked as read.", "marked": marked}, status=status.HTTP_200_OK)
+
+        elif action == 'get_inbox':
+            conversations = ConversationSummary.objects.filter(owner=user).order_by('-last_timestamp').values(
+                'friend_id',
+                'friend__username',
+                'last_message_id',
+                'last_message__sender_id',
+                'last_message__content',
+                'last_timestamp',
+                'unread_count',
+            )
 
-            return Response({"results": list(users)}, status=status.HTTP_200_OK)
+            inbox = [
+                {
+                    "friend_id": conversation['friend_id'],
+                    "friend_username": conversation['friend__username'],
+                    "last_message_id": conversation['last_message_id'],
+                    "last_sender_id": conversation['last_message__sender_id'],
+                    "last_message": conversation['last_message__content'],
+                    "last_timestamp": conversation['last_timestamp'],
+                    "unread_count": conversation['unread_count'],
+                }
+                for conversation in conversations
+            ]
+            return Response({"inbox": inbox}, status=status.HTTP_200_OK)
 
         else:
-            return Response({"error": "Invalid action. Use 'add_friend', 'decline_friend', 'remove_request', 'accept_friend', or 'view_friends'."}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({"error": "Invalid action. Use 'send_message', 'get_messages', 'mark_read' or 'get_inbox'."}, status=status.HTTP_400_BAD_REQUEST)
 
+    def send_message(self, request, user_id):
+        recipient_id = request.data.get('recipient_id')
+        content = request.data.get('content')
 
-class ChatView(APIView):
-    def post(self, request):
-        action = request.data.get('action')
-        user_id = request.data.get('userID')
-        user = get_object_or_404(User, userID=user_id)
-
-        if action == 'send_message':
-            recipient_id = request.data.get('recipient_id')
-            content = request.data.get('content')
+        if not all([user_id, recipient_id, content]):
+            return Response({"error": "userID, recipient_id and content are required."}, status=status.HTTP_400_BAD_REQUEST)
 
-            if not all([recipient_id, content]):
-                return Response({"error": "recipient_id and content are required."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            user_id, recipient_id = int(user_id), int(recipient_id)
+        except (TypeError, ValueError):
+            return Response({"error": "userID and recipient_id must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+
+        # A cached friendship also proves both users exist, so no User lookups are needed
+        if not are_friends(user_id, recipient_id):
+            return Response({"error": "You can only chat with friends."}, status=status.HTTP_403_FORBIDDEN)
+
+        with transaction.atomic():
+            message = Message.objects.create(sender_id=user_id, recipient_id=recipient_id, content=content)
+            ConversationSummary.record_message(message)
+        serializer = MessageSerializer(message)
+        broadcast_message(serializer.data)  # Push to both participants' sockets
+        return Response({"message": "Message sent.", "data": serializer.data}, status=status.HTTP_201_CREATED)
+
+    def get_friend_data(self, request, user_id):
+        friend_id = request.data.get('friend_id')
+        if not user_id or not friend_id:
+            return Response({"error": "userID and friend_id are required."}, status=status.HTTP_400_BAD_REQUEST)
 
-            recipient = get_object_or_404(User, userID=recipient_id)
+        try:
+            user_id, friend_id = int(user_id), int(friend_id)
+        except (TypeError, ValueError):
+            return Response({"error": "userID and friend_id must be integers."}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Check if they are friends
-            is_friend = FriendList.objects.filter(
-                (Q(from_user=user, to_user=recipient) | Q(from_user=recipient, to_user=user)),
-                accepted=True
-            ).exists()
+        if not are_friends(user_id, friend_id):
+            return Response({"error": "You can only view data of friends."}, status=status.HTTP_403_FORBIDDEN)
 
-            if not is_friend:
-                return Response({"error": "You can only chat with friends."}, status=status.HTTP_403_FORBIDDEN)
+        friend_data = get_object_or_404(User.objects.values('userID', 'username'), userID=friend_id)
+        friend_data['status'] = get_presence([friend_id])[friend_id]
+        return Response({"friend_data": friend_data}, status=status.HTTP_200_OK)
 
-            message = Message.objects.create(sender=user, recipient=recipient, content=content)
-            serializer = MessageSerializer(message)
-            return Response({"message": "Message sent.", "data": serializer.data}, status=status.HTTP_201_CREATED)
+class PresenceView(APIView):
+    def post(self, request):
+        action = request.data.get('action')
 
-        elif action == 'get_messages':
-            friend_id = request.data.get('friend_id')
-            if not friend_id:
-                return Response({"error": "friend_id is required."}, status=status.HTTP_400_BAD_REQUEST)
+        if action == 'heartbeat':
+            user_id = request.data.get('userID')
+            state = request.data.get('state', 'online')
 
-            friend = get_object_or_404(User, userID=friend_id)
+            if not user_id:
+                return Response({"error": "userID is required."}, status=status.HTTP_400_BAD_REQUEST)
+            if state not in PRESENCE_STATES:
+                return Response({"error": f"Invalid state. Must be one of {list(PRESENCE_STATES)}."}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Get messages between the two users
-            messages = Message.objects.filter(
-                (Q(sender=user, recipient=friend) | Q(sender=friend, recipient=user))
-            ).order_by('timestamp')
+            try:
+                heartbeat(int(user_id), state)
+            except (TypeError, ValueError):
+                return Response({"error": "userID must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
 
-            serializer = MessageSerializer(messages, many=True)
-            return Response({"messages": serializer.data}, status=status.HTTP_200_OK)
-        
-        elif action == 'get_friend_data':
-            friend_id = request.data.get('friend_id')
-            if not friend_id:
-                return Response({"error": "friend_id is required."}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({"status": state}, status=status.HTTP_200_OK)
 
-            friend = get_object_or_404(User, userID=friend_id)
+        elif action == 'get_presence':
+            user_ids = request.data.get('user_ids')
 
-            # Check if they are friends
-            is_friend = FriendList.objects.filter(
-                (Q(from_user=user, to_user=friend) | Q(from_user=friend, to_user=user)),
-                accepted=True
-            ).exists()
+            if not isinstance(user_ids, list) or not user_ids:
+                return Response({"error": "user_ids must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
 
-            if not is_friend:
-                return Response({"error": "You can only view data of friends."}, status=status.HTTP_403_FORBIDDEN)
+            try:
+                presence = get_presence(user_ids)
+            except (TypeError, ValueError):
+                return Response({"error": "user_ids must be integers."}, status=status.HTTP_400_BAD_REQUEST)
 
-            friend_data = {
-                "userID": friend.userID,
-                "username": friend.username,
-                "status": friend.status
-            }
-            return Response({"friend_data": friend_data}, status=status.HTTP_200_OK)
+            return Response({"presence": presence}, status=status.HTTP_200_OK)
 
         else:
-            return Response({"error": "Invalid action. Use 'send_message' or 'get_messages'."}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({"error": "Invalid action. Use 'heartbeat' or 'get_presence'."}, status=status.HTTP_400_BAD_REQUEST)
 
 class RetrieveAvatarView(APIView):
     def post(self, request):
@@ -846,28 +947,14 @@ class RetrieveAvatarView(APIView):
             return Response({"error": "userID is required."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            avatar = Avatar.objects.get(user__userID=user_id)
-            avatar_data = {
-                "avatarID": avatar.avatarID,
-                "userID": avatar.user.userID,
-                "head": avatar.head,
-                "body": avatar.body,
-                "left_arm": avatar.left_arm,
-                "right_arm": avatar.right_arm,
-                "left_leg": avatar.left_leg,
-                "right_leg": avatar.right_leg,
-                "hat": avatar.hat,
-                "eyes": avatar.eyes,
-                "face_accessories": avatar.face_accessories,
-                "facial_expression": avatar.facial_expression,
-                "upperwear": avatar.upperwear,
-                "lowerwear": avatar.lowerwear,
-                "shoes": avatar.shoes,
-            }
-            return Response(avatar_data, status=status.HTTP_200_OK)
+            avatar_data = Avatar.layer_rows([int(user_id)]).get(int(user_id))
+        except (TypeError, ValueError):
+            return Response({"error": "userID must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
 
-        except Avatar.DoesNotExist:
+        if avatar_data is None:
             return Response({"error": "Avatar not found for the given userID."}, status=status.HTTP_404_NOT_FOUND)
+        attach_sprites([avatar_data])
+        return Response(avatar_data, status=status.HTTP_200_OK)
 
     def put(self, request):
         user_id = request.data.get("userID")
@@ -877,10 +964,7 @@ class RetrieveAvatarView(APIView):
         if not user_id or not item_type or not item_url:
             return Response({"error": "userID, item_type, and url are required."}, status=status.HTTP_400_BAD_REQUEST)
 
-        valid_fields = [
-            "hat", "eyes", "face_accessories", "facial_expression",
-            "upperwear", "lowerwear", "shoes"
-        ]
+        valid_fields = list(Avatar.EQUIP_SLOTS)
 
         if item_type not in valid_fields:
             return Response({"error": f"Invalid item_type. Must be one of {valid_fields}."}, status=status.HTTP_400_BAD_REQUEST)
@@ -888,14 +972,83 @@ class RetrieveAvatarView(APIView):
         try:
             avatar = Avatar.objects.get(user__userID=user_id)
             setattr(avatar, item_type, item_url)
-            avatar.save()
+            avatar.save(update_fields=[item_type])
+            queue_sprites([{field: getattr(avatar, field) for field in Avatar.LAYER_FIELDS}])
             return Response({"message": f"{item_type} equipped successfully."}, status=status.HTTP_200_OK)
 
         except Avatar.DoesNotExist:
             return Response({"error": "Avatar not found for the given userID."}, status=status.HTTP_404_NOT_FOUND)
         except ValidationError as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
-      
+
+    def patch(self, request):
+        """
+        Equip a whole outfit at once: `slots` maps slot -> item image URL (null unequips).
+        Every URL must belong to an owned item of that part; only changed columns are written.
+        """
+        user_id = request.data.get("userID")
+        slots = request.data.get("slots")
+
+        if not user_id or not isinstance(slots, dict) or not slots:
+            return Response({"error": "userID and a non-empty slots object are required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        invalid = sorted(set(slots) - set(Avatar.EQUIP_SLOTS))
+        if invalid:
+            return Response({"error": f"Invalid slots {invalid}. Must be drawn from {list(Avatar.EQUIP_SLOTS)}."}, status=status.HTTP_400_BAD_REQUEST)
+        if not all(url is None or isinstance(url, str) for url in slots.values()):
+            return Response({"error": "Slot values must be a URL string or null."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            current = Avatar.objects.filter(user_id=int(user_id)).values(*Avatar.LAYER_FIELDS).first()
+        except (TypeError, ValueError):
+            return Response({"error": "userID must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+        if current is None:
+            return Response({"error": "Avatar not found for the given userID."}, status=status.HTTP_404_NOT_FOUND)
+
+        changes = {slot: url for slot, url in slots.items() if current[slot] != url}
+
+        # One query for every owned item behind the requested URLs
+        wanted = {url for url in changes.values() if url is not None}
+        owned = set()
+        if wanted:
+            owned = {
+                (Avatar.slot_for_part(part), url)
+                for part, url in Inventory.objects.filter(owner_id=user_id, item__avatar_image__in=wanted)
+                .values_list('item__part', 'item__avatar_image')
+            }
+        not_owned = sorted(slot for slot, url in changes.items() if url is not None and (slot, url) not in owned)
+        if not_owned:
+            return Response({"error": f"You do not own an item for slot(s) {not_owned}."}, status=status.HTTP_403_FORBIDDEN)
+
+        if changes:
+            Avatar.objects.filter(user_id=user_id).update(**changes)
+            current.update(changes)
+            queue_sprites([current])  # Composed in the background before friends next load it
+
+        return Response({"message": "Outfit equipped successfully.", "changed": sorted(changes), "hash": Avatar.content_hash(current)}, status=status.HTTP_200_OK)
+
+
+class RetrieveAvatarsView(APIView):
+    max_batch_size = 100
+
+    def post(self, request):
+        user_ids = request.data.get("userIDs")
+
+        if not isinstance(user_ids, list) or not user_ids:
+            return Response({"error": "userIDs must be a non-empty list."}, status=status.HTTP_400_BAD_REQUEST)
+        if len(user_ids) > self.max_batch_size:
+            return Response({"error": f"At most {self.max_batch_size} userIDs per request."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            user_ids = list(dict.fromkeys(int(user_id) for user_id in user_ids))  # Dedupe, keep order
+        except (TypeError, ValueError):
+            return Response({"error": "userIDs must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+
+        found = Avatar.layer_rows(user_ids)
+        avatars = attach_sprites(found[user_id] for user_id in user_ids if user_id in found)
+        missing = [user_id for user_id in user_ids if user_id not in found]
+        return Response({"avatars": avatars, "missing": missing}, status=status.HTTP_200_OK)
+
 class GameInfoView(APIView):
     def post(self, request):
         action = request.data.get('action')
@@ -949,39 +1102,35 @@ class RoomView(APIView):
         user = get_object_or_404(User, userID=user_id)
 
         if action == 'get_room_items':
-            room_items = RoomItem.objects.filter(
-                item__owner=user,
-                item__item__category="Room"
-            )
-            serializer = RoomItemSerializer(room_items, many=True)
-            return Response({"room_items": serializer.data}, status=status.HTTP_200_OK)
+            since_version = request.data.get('since_version')  # Optional: the client's last seen room version
+            if since_version is not None:
+                try:
+                    since_version = int(since_version)
+                except (TypeError, ValueError):
+                    return Response({"error": "since_version must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+            return Response(room_snapshot(user.userID, since_version), status=status.HTTP_200_OK)
         
         elif action == 'sync_room_items':
-            # Get inventory items with category "Room"
-            room_inventory_items = Inventory.objects.filter(
-                owner=user,
-                item__category="Room"
-            )
-
-            created = 0
-            for inv in room_inventory_items:
-                # Only create if not already linked in RoomItem
-                if not RoomItem.objects.filter(item=inv).exists():
-                    RoomItem.objects.create(
-                        item=inv,
-                        type=inv.item.part,  # you can make this dynamic
-                        x=0,
-                        y=0,
-                        width=1,
-                        height=1,
-                        state="idle",
-                        allowOverlap=False,
-                        placed=False,
-                        image = inv.item.store_image
-                    )
-                    created += 1
-
-            return Response({"message": f"Synced RoomItems. {created} new item(s) created."}, status=status.HTTP_201_CREATED)
+            # One RoomItem per owned copy of each "Room" inventory stack
+            created = RoomItem.sync_for_owner(user.userID)
+            response = {"message": f"Synced RoomItems. {created} new item(s) created."}
+
+            if request.data.get('auto_place'):
+                placed, unfit = auto_place(user.userID)
+                response.update(placed=placed, unplaced=unfit)
+            return Response(response, status=status.HTTP_201_CREATED)
+
+        elif action == 'auto_place':
+            room_item_ids = request.data.get('room_item_ids')  # Optional, defaults to every unplaced item
+            if room_item_ids is not None:
+                try:
+                    room_item_ids = [int(room_item_id) for room_item_id in room_item_ids]
+                except (TypeError, ValueError):
+                    return Response({"error": "room_item_ids must be a list of integers."}, status=status.HTTP_400_BAD_REQUEST)
+
+            placed, unfit = auto_place(user.userID, room_item_ids)
+            return Response({"placed": placed, "unplaced": unfit}, status=status.HTTP_200_OK)
 
         elif action == 'place_room_item':
             room_item_id = request.data.get('room_item_id')
@@ -1004,10 +1153,39 @@ class RoomView(APIView):
             room_item.state = state
             room_item.allowOverlap = allow_overlap
             room_item.placed = True
-            room_item.save()
+            with transaction.atomic():
+                room_item.save()
+                RoomChange.record(user.userID, changed=[room_item.id])
 
             serializer = RoomItemSerializer(room_item)
             return Response({"message": "Room item placed.", "data": serializer.data}, status=status.HTTP_200_OK)
 
+        elif action == 'save_layout':
+            try:
+                saved = save_layout(user.userID, request.data.get('placements'))
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            except RoomItem.DoesNotExist:
+                return Response({"error": "Unknown room_item_id in placements."}, status=status.HTTP_404_NOT_FOUND)
+            except LayoutConflict as e:
+                return Response({"error": str(e), "conflicts": e.conflicts}, status=status.HTTP_409_CONFLICT)
+
+            return Response({"message": f"Layout saved. {len(saved)} item(s) updated.", "conflicts": []}, status=status.HTTP_200_OK)
+
         else:
-            return Response({"error": "Invalid action. Use 'get_room_items' or 'place_room_item'."}, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+            return Response({"error": "Invalid action. Use 'get_room_items', 'sync_room_items', 'auto_place', 'place_room_item' or 'save_layout'."}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class VisitRoomView(APIView):
+    def post(self, request):
+        # Served from the cache for repeat visits: no User lookup, the friend check is cached too
+        try:
+            user_id = int(request.data.get('userID'))
+            owner_id = int(request.data.get('owner_id'))
+        except (TypeError, ValueError):
+            return Response({"error": "userID and owner_id must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if owner_id != user_id and not are_friends(user_id, owner_id):
+            return Response({"error": "You can only visit your friends' rooms."}, status=status.HTTP_403_FORBIDDEN)
+
+        return Response(visit_snapshot(owner_id), status=status.HTTP_200_OK)